@@ -0,0 +1,280 @@
+import os
+import sys
+import argparse
+import datetime
+from contextlib import contextmanager
+import numpy as np
+from client import get_clean_day, logger
+from histogram import (GRANULARITIES, get_bin_edges, get_bin_labels,
+                       print_period_counts, to_days)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+INDEX_PATH = 'activity_index.npz'
+SUBSCRIPTIONS = 'subscriptions'
+MERGED = 'merged'
+KINDS = (SUBSCRIPTIONS, MERGED)
+
+
+def to_day(date_object):
+    """ Return day number since 1970-01-01 of a date or yyyy-mm-dd string"""
+    return int(np.datetime64(date_object, 'D').astype(np.int64))
+
+
+def get_last_settled_day():
+    """ Return day number of yesterday, the last day no event can add to"""
+    return to_day(datetime.date.today()) - 1
+
+
+def get_file_stamp(stat_result):
+    """ Return what changes when the index file is replaced"""
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+class ActivityIndex:
+    """
+    Daily event counts per user and kind in one array, with prefix
+    sums answering the count of any covered day range in O(1)
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        # ranges set since the last save, written over the rows
+        # on file when saving so other writers' rows are kept
+        self.update_list = []
+        self.load()
+
+    def load(self):
+        """ Read the index file, empty if there is none"""
+        self.key_list = []
+        self.first_day = 0
+        self.counts = np.zeros((0, 0), dtype=np.int32)
+        # days whose counts were set from a complete fetch
+        self.covered = np.zeros((0, 0), dtype=bool)
+        self.file_stamp = None
+        try:
+            index_file = open(self.path, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            with index_file, np.load(index_file) as index_data:
+                self.file_stamp = get_file_stamp(os.fstat(index_file.fileno()))
+                self.key_list = index_data['keys'].tolist()
+                self.first_day = int(index_data['first_day'])
+                self.counts = index_data['counts']
+                self.covered = index_data['covered']
+        self.row_dict = {key: row for row, key in enumerate(self.key_list)}
+        self.update_prefix_sums()
+
+    def refresh(self):
+        """ Reload the file if another process saved it since"""
+        try:
+            file_stamp = get_file_stamp(os.stat(self.path))
+        except FileNotFoundError:
+            file_stamp = None
+        if file_stamp != self.file_stamp:
+            self.load()
+            for update in self.update_list:
+                self.write_range(*update)
+
+    def update_prefix_sums(self):
+        """ Recompute prefix sums, led by a zero column for empty sums"""
+        zero_column = np.zeros((self.counts.shape[0], 1), dtype=np.int64)
+        self.count_prefix = np.hstack([
+            zero_column, np.cumsum(self.counts, axis=1, dtype=np.int64)])
+        self.covered_prefix = np.hstack([
+            zero_column, np.cumsum(self.covered, axis=1, dtype=np.int64)])
+
+    def get_row(self, kind, name):
+        """ Return row of kind and name, adding an empty one if new"""
+        key = '{}:{}'.format(kind, name)
+        row = self.row_dict.get(key)
+        if row is None:
+            row = self.row_dict[key] = len(self.key_list)
+            self.key_list.append(key)
+            day_count = self.counts.shape[1]
+            self.counts = np.vstack([
+                self.counts, np.zeros((1, day_count), dtype=np.int32)])
+            self.covered = np.vstack([
+                self.covered, np.zeros((1, day_count), dtype=bool)])
+        return row
+
+    def extend(self, first_day, last_day):
+        """ Widen the day columns to span first_day to last_day"""
+        day_count = self.counts.shape[1]
+        if not day_count:
+            self.first_day = first_day
+            pad_width = (0, last_day - first_day + 1)
+        else:
+            pad_width = (
+                max(0, self.first_day - first_day),
+                max(0, last_day - (self.first_day + day_count - 1)))
+        if any(pad_width):
+            self.counts = np.pad(self.counts, ((0, 0), pad_width))
+            self.covered = np.pad(self.covered, ((0, 0), pad_width))
+            self.first_day -= pad_width[0]
+
+    def set_range(self, kind, name, first_day, last_day, day_counts):
+        """
+        Replace counts of first_day to last_day by day_counts,
+        a complete count of those days, and mark them covered
+        """
+        if first_day > last_day:
+            return
+        day_counts = np.asarray(day_counts, dtype=np.int32)
+        self.update_list.append((kind, name, first_day, last_day, day_counts))
+        self.write_range(kind, name, first_day, last_day, day_counts)
+
+    def write_range(self, kind, name, first_day, last_day, day_counts):
+        """ Set counts of first_day to last_day and mark them covered"""
+        row = self.get_row(kind, name)
+        self.extend(first_day, last_day)
+        start = first_day - self.first_day
+        end = last_day - self.first_day + 1
+        self.counts[row, start:end] = day_counts
+        self.covered[row, start:end] = True
+        self.update_prefix_sums()
+
+    def set_epochs(self, kind, name, epoch_list, start_date, end_date):
+        """
+        Count epochs per day as all events of start_date to
+        end_date, covering no day that may still get events
+        """
+        first_day = to_day(start_date)
+        last_day = min(to_day(end_date), get_last_settled_day())
+        day_array = to_days(epoch_list)
+        in_range = (day_array >= first_day) & (day_array <= last_day)
+        self.set_range(kind, name, first_day, last_day, np.bincount(
+            day_array[in_range] - first_day,
+            minlength=max(0, last_day - first_day + 1)))
+
+    def set_day_counts(self, kind, name, day_count_dict, start_date,
+                       end_date):
+        """
+        Count events per day number of day_count_dict as all events
+        of start_date to end_date, covering no unsettled day
+        """
+        first_day = to_day(start_date)
+        last_day = min(to_day(end_date), get_last_settled_day())
+        day_counts = np.zeros(max(0, last_day - first_day + 1),
+                              dtype=np.int32)
+        for day, count in day_count_dict.items():
+            if first_day <= day <= last_day:
+                day_counts[day - first_day] = count
+        self.set_range(kind, name, first_day, last_day, day_counts)
+
+    def count(self, kind, name, first_day, last_day):
+        """
+        Return events of first_day to last_day,
+        None unless every day is covered
+        """
+        row = self.row_dict.get('{}:{}'.format(kind, name))
+        if row is None:
+            return None
+        start = first_day - self.first_day
+        end = last_day - self.first_day + 1
+        if start < 0 or end > self.counts.shape[1]:
+            return None
+        if start >= end:
+            return 0
+        covered_days = (self.covered_prefix[row, end]
+                        - self.covered_prefix[row, start])
+        if covered_days != end - start:
+            return None
+        return int(self.count_prefix[row, end] - self.count_prefix[row, start])
+
+    def get_period_counts(self, kind, name, start_date, end_date,
+                          granularity='week'):
+        """
+        Return dictionary mapping period label to events of kind
+        between start and end date, None if a day is not covered
+        """
+        self.refresh()
+        first_day, last_day = to_day(start_date), to_day(end_date)
+        edge_days = get_bin_edges(start_date, end_date, granularity)
+        count_list = []
+        for bin_start, bin_end in zip(edge_days[:-1], edge_days[1:]):
+            count = self.count(kind, name, max(int(bin_start), first_day),
+                               min(int(bin_end) - 1, last_day))
+            if count is None:
+                return None
+            count_list.append(count)
+        return dict(zip(get_bin_labels(edge_days[:-1], granularity),
+                        count_list))
+
+    def get_month_weeks(self, kind, name, month_date):
+        """
+        Return events of kind in five buckets of seven days from the
+        first of the month of month_date, None if a day is not covered
+        """
+        self.refresh()
+        first_day = to_day(month_date.strftime('%Y-%m-01'))
+        next_month = (month_date.replace(day=28)
+                      + datetime.timedelta(4)).replace(day=1)
+        last_day = to_day(next_month.strftime('%Y-%m-01')) - 1
+        week_dict = {}
+        for week_index in range(5):
+            week_start = first_day + week_index * 7
+            count = self.count(kind, name, week_start,
+                               min(week_start + 6, last_day))
+            if count is None:
+                return None
+            week_dict[str(week_index + 1)] = count
+        return week_dict
+
+    @contextmanager
+    def locked(self):
+        """ Hold the index lock file, shared by all writing processes"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def save(self):
+        """
+        Write ranges set since the last save over the rows on file,
+        replacing the old file in one step under the lock file
+        """
+        with self.locked():
+            self.refresh()
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as index_file:
+                np.savez_compressed(
+                    index_file, keys=np.array(self.key_list, dtype=str),
+                    first_day=self.first_day, counts=self.counts,
+                    covered=self.covered)
+            os.replace(temp_path, self.path)
+            self.file_stamp = get_file_stamp(os.stat(self.path))
+        self.update_list = []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Answer activity counts from the local index only')
+    parser.add_argument('kind', choices=KINDS)
+    parser.add_argument('name', help='Phabricator username or Gerrit owner')
+    parser.add_argument('--start', metavar='YYYY-MM-DD', required=True)
+    parser.add_argument('--end', metavar='YYYY-MM-DD',
+                        help='last day of the range, default yesterday')
+    parser.add_argument('--granularity', choices=GRANULARITIES,
+                        default='week')
+    args = parser.parse_args()
+    start_date = get_clean_day(args.start)
+    if args.end:
+        end_date = get_clean_day(args.end)
+    else:
+        end_date = datetime.datetime.now() - datetime.timedelta(1)
+    count_dict = ActivityIndex().get_period_counts(
+        args.kind, args.name, start_date, end_date, args.granularity)
+    if count_dict is None:
+        logger(None, 'no complete {} index of {} for this range'.format(
+            args.kind, args.name))
+        sys.exit()
+    print_period_counts(count_dict, args.granularity.title(),
+                        args.kind.title())
@@ -0,0 +1,224 @@
+import sys
+import json
+import asyncio
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import client
+import issue_fetcher
+import task_statistics
+from activity_index import ActivityIndex
+from cache import ResponseCache
+from client import (CONCURRENCY, MAX_CONCURRENCY, REQUEST_TIMEOUT,
+                    FetchError, get_clean_day, get_user_phids, get_window,
+                    logger, open_async_session)
+from histogram import GRANULARITIES, bin_day_counts, get_bin_labels
+from metrics import metrics
+from scheduler import AIMDController
+
+
+# owners whose Gerrit changes are fetched at the same time
+GERRIT_WORKERS = 8
+
+
+def parse_user(user_string):
+    """ Return (Phabricator username, Gerrit owner) of username:owner"""
+    username, _, owner_name = user_string.partition(':')
+    if not username or not owner_name:
+        logger(None, 'enter users as phabricator-username:gerrit-owner')
+        sys.exit()
+    return username, owner_name
+
+
+def get_merged_days(owner_name, start_date, shards=0):
+    """
+    Return ChangeStats of owner's changes merged since start_date,
+    counting merges per local day
+    """
+    start_string = start_date.strftime('%Y-%m-%d')
+    query_params = issue_fetcher.clean_input(
+        owner_name, 'merged', start_string)
+    if shards:
+        end_string = (datetime.date.today()
+                      + datetime.timedelta(1)).isoformat()
+        change_iter = issue_fetcher.iter_sharded_changes(
+            client.GERRIT_URL, query_params, start_string, end_string, shards)
+    else:
+        change_iter = issue_fetcher.iter_gerrit_changes(
+            client.GERRIT_URL, issue_fetcher.format_query_params(query_params))
+    return issue_fetcher.get_change_stats(change_iter)
+
+
+async def get_subs_dates(username_list, start_date, end_date):
+    """
+    Return dictionary mapping username to subscription dates
+    and list of task id's that could not be fetched
+    """
+    # on the loop's default executor, not queued behind Gerrit owners
+    phid_dict = await asyncio.get_running_loop().run_in_executor(
+        None, get_user_phids, username_list)
+    window_start, window_end = get_window(start_date, end_date)
+    controller = AIMDController(CONCURRENCY, max_limit=MAX_CONCURRENCY)
+    async with open_async_session(REQUEST_TIMEOUT) as session:
+        result_list = await asyncio.gather(*[
+            task_statistics.subs_pipeline(
+                session, controller, username, phid, window_start,
+                window_end)
+            for username, phid in phid_dict.items()
+        ])
+    subs_date_dict = {}
+    missing_id_list = []
+    for username, (subs_date_list, failed_id_list) in zip(
+            phid_dict, result_list):
+        subs_date_dict[username] = subs_date_list
+        missing_id_list.extend(failed_id_list)
+    return subs_date_dict, missing_id_list
+
+
+async def gather_activity(user_list, start_date, end_date, shards=0):
+    """
+    Return Gerrit ChangeStats per owner, subscription dates per
+    username and unfetched task id's, both sources fetched at once
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(GERRIT_WORKERS) as executor:
+        gerrit_future = asyncio.gather(*[
+            loop.run_in_executor(
+                executor, get_merged_days, owner_name, start_date, shards)
+            for _, owner_name in user_list
+        ])
+        subs_date_dict, missing_id_list = await get_subs_dates(
+            [username for username, _ in user_list], start_date, end_date)
+        stats_list = await gerrit_future
+    stats_dict = {
+        owner_name: change_stats
+        for (_, owner_name), change_stats in zip(user_list, stats_list)
+    }
+    return stats_dict, subs_date_dict, missing_id_list
+
+
+def get_timeline(user_list, stats_dict, subs_date_dict, start_date,
+                 end_date, granularity):
+    """
+    Return list of per-user dictionaries with merged changes
+    and subscriptions per period between start and end date
+    """
+    subs_count_dict_dict = task_statistics.get_subs_per_period(
+        subs_date_dict, start_date, end_date, granularity)
+    timeline_list = []
+    for username, owner_name in user_list:
+        bin_start_days, merged_counts = bin_day_counts(
+            stats_dict[owner_name].merged_day_counts, start_date, end_date,
+            granularity)
+        label_list = get_bin_labels(bin_start_days, granularity)
+        subs_count_dict = subs_count_dict_dict.get(username, {})
+        timeline_list.append({
+            'username': username,
+            'owner': owner_name,
+            'periods': [
+                {
+                    'period': label,
+                    'merged': int(merged_count),
+                    'subscriptions': subs_count_dict.get(label, 0),
+                }
+                for label, merged_count in zip(label_list, merged_counts)
+            ],
+        })
+    return timeline_list
+
+
+def print_timeline(timeline_list, period_name='Week'):
+    """ Print merged changes and subscriptions of each user per period"""
+    width = max([len(period_name)] + [
+        len(period_dict['period'])
+        for user_dict in timeline_list for period_dict in user_dict['periods']
+    ]) + 2
+    border = '+' + '-' * width + '+----------+---------------+'
+    for user_dict in timeline_list:
+        print('{} ({})'.format(user_dict['username'], user_dict['owner']))
+        print(border)
+        print('|', period_name.center(width, ' '), '|  Merged  |',
+              '  Subscription |', sep='')
+        print(border)
+        for period_dict in user_dict['periods']:
+            print('|', period_dict['period'].center(width, ' '), '|',
+                  str(period_dict['merged']).center(10, ' '), '|',
+                  str(period_dict['subscriptions']).center(15, ' '), '|',
+                  sep='')
+        print(border)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Merged Gerrit changes and Phabricator subscriptions '
+        'of developers per period')
+    parser.add_argument('users', nargs='*', metavar='USERNAME:OWNER',
+                        help='Phabricator username and Gerrit owner, eg '
+                        'pmiazga:pmiazga@wikimedia.org')
+    parser.add_argument('--team', metavar='FILE',
+                        help='read USERNAME:OWNER pairs from FILE, one per '
+                        'line')
+    parser.add_argument('--start', metavar='YYYY-MM-DD', required=True)
+    parser.add_argument('--end', metavar='YYYY-MM-DD',
+                        help='last day of the report, default today')
+    parser.add_argument('--granularity', choices=GRANULARITIES,
+                        default='week')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='split each Gerrit query into this many date '
+                        'windows')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as json')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help='write request and phase metrics as json')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='write metrics in Prometheus text format')
+    args = parser.parse_args()
+    user_string_list = list(args.users)
+    if args.team:
+        with open(args.team) as team_file:
+            user_string_list.extend(
+                line.strip() for line in team_file if line.strip())
+    if not user_string_list:
+        parser.error('give at least one USERNAME:OWNER or --team')
+    user_list = [parse_user(user_string) for user_string in user_string_list]
+    start_date = get_clean_day(args.start)
+    if args.end:
+        end_date = get_clean_day(args.end)
+    else:
+        end_date = datetime.datetime.now()
+    client.cache = ResponseCache()
+
+    # Gerrit and Phabricator are fetched side by side
+    with metrics.phase('fetch'):
+        try:
+            stats_dict, subs_date_dict, missing_id_list = asyncio.run(
+                gather_activity(user_list, start_date, end_date, args.shards))
+        except FetchError as e:
+            logger(e, str(e))
+            sys.exit()
+    with metrics.phase('aggregate'):
+        timeline_list = get_timeline(
+            user_list, stats_dict, subs_date_dict, start_date, end_date,
+            args.granularity)
+    index = ActivityIndex()
+    if not missing_id_list:
+        task_statistics.index_subs(
+            index, subs_date_dict, start_date, end_date)
+    # merged changes were fetched up to now, whatever the report's end
+    for owner_name, change_stats in stats_dict.items():
+        issue_fetcher.index_merged(
+            owner_name, change_stats, start_date,
+            datetime.datetime.now() + datetime.timedelta(1))
+    if args.json:
+        print(json.dumps({
+            'start': start_date.strftime('%Y-%m-%d'),
+            'end': end_date.strftime('%Y-%m-%d'),
+            'granularity': args.granularity,
+            'users': timeline_list,
+            'missing_tasks': missing_id_list,
+        }, indent=2))
+    else:
+        print_timeline(timeline_list, args.granularity.title())
+        if missing_id_list:
+            task_statistics.print_missing_tasks(missing_id_list)
+    metrics.write(args.metrics_json, args.metrics_prom)
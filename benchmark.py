@@ -0,0 +1,615 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import calendar
+import functools
+import importlib
+import resource
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+USERNAME = 'benchuser'
+OWNER_NAME = 'benchuser@example.org'
+# owners queried by the team engines, changes are spread over --owners
+TEAM_SIZE = 20
+# 2018-05-01, subscription dates are spread over the following month
+DATASET_START = 1525132800
+SEARCH_PAGE_SIZE = 100
+# changes are updated an hour apart from DATASET_START on
+SHARD_START_DATE = '2018-05-01'
+SHARD_END_DATE = '2020-01-01'
+CHANGE_STATUSES = ('MERGED', 'NEW', 'ABANDONED')
+
+
+def percentile(value_list, percent):
+    """ Return nearest-rank percentile of a list of values"""
+    if not value_list:
+        return 0
+    sorted_list = sorted(value_list)
+    rank = max(int(round(percent / 100 * len(sorted_list))) - 1, 0)
+    return sorted_list[rank]
+
+
+def user_phid(username):
+    """ Return PhID the mock server assigns to username"""
+    return 'PHID-USER-{}'.format(username)
+
+
+def get_subs_epoch(task_id):
+    """ Return mock date the user subscribed to a task"""
+    return DATASET_START + (task_id * 7919) % (30 * 24 * 60 * 60)
+
+
+def make_transactions(task_id, transaction_count, payload_bytes):
+    """ Return mock transaction list of a task"""
+    phid = user_phid(USERNAME)
+    subs_date = get_subs_epoch(task_id)
+    transaction_list = []
+    for index in range(transaction_count):
+        transaction = {
+            'taskID': str(task_id),
+            'transactionID': str(task_id * 1000 + index),
+            'transactionType': 'core:comment',
+            'oldValue': None,
+            'newValue': None,
+            'comments': 'x' * payload_bytes,
+            'authorPHID': phid,
+            'dateCreated': str(subs_date + index),
+        }
+        if index == 0:
+            transaction.update(
+                transactionType='core:subscribers',
+                oldValue=[], newValue=[phid], comments=None)
+        elif index == 1 and task_id % 2:
+            transaction.update(
+                transactionType='status',
+                oldValue='open', newValue='resolved', comments=None)
+        transaction_list.append(transaction)
+
+    return transaction_list
+
+
+def to_search_transaction(transaction):
+    """ Return mock transaction in transaction.search format"""
+    data_dict = {
+        'id': int(transaction['transactionID']),
+        'type': transaction['transactionType'].replace('core:', ''),
+        'authorPHID': transaction['authorPHID'],
+        'dateCreated': int(transaction['dateCreated']),
+        'comments': [],
+        'fields': {},
+    }
+    if transaction['transactionType'] == 'core:subscribers':
+        data_dict['fields']['operations'] = [
+            {'operation': 'add', 'phid': phid}
+            for phid in transaction['newValue']
+        ]
+    elif transaction['transactionType'] == 'core:comment':
+        data_dict['comments'] = [{'content': {'raw': transaction['comments']}}]
+    else:
+        data_dict['fields'] = {'old': transaction['oldValue'],
+                               'new': transaction['newValue']}
+    return data_dict
+
+
+def get_change_updated(index):
+    """ Return mock date a Gerrit change was last updated"""
+    return DATASET_START + index * 3600 + 7200
+
+
+def get_owner_name(owner_index):
+    """ Return email of a mock Gerrit owner"""
+    if not owner_index:
+        return OWNER_NAME
+    return 'benchuser{}@example.org'.format(owner_index)
+
+
+def make_change(index, owner_count=1, detailed_accounts=False):
+    """ Return mock Gerrit change"""
+    owner_index = index % owner_count
+    created = get_change_updated(index) - 7200
+    change = {
+        'id': 'project~master~I{:040x}'.format(index),
+        'project': 'project/{}'.format(index % 7),
+        'branch': 'master',
+        'status': CHANGE_STATUSES[index % len(CHANGE_STATUSES)],
+        'created': time.strftime(
+            '%Y-%m-%d %H:%M:%S.000000000', time.gmtime(created)),
+        'updated': time.strftime(
+            '%Y-%m-%d %H:%M:%S.000000000',
+            time.gmtime(get_change_updated(index))),
+        'insertions': index % 50,
+        'deletions': index % 20,
+        '_number': index,
+        'owner': {'_account_id': 1000 + owner_index},
+    }
+    if detailed_accounts:
+        change['owner']['email'] = get_owner_name(owner_index)
+    if change['status'] == 'MERGED':
+        # merged after one to 72 hours
+        change['submitted'] = time.strftime(
+            '%Y-%m-%d %H:%M:%S.000000000',
+            time.gmtime(created + 3600 * (1 + index % 72)))
+    return change
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """ Serve mock Conduit and Gerrit responses"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        start_time = time.time()
+        parsed_url = urlparse(self.path)
+        query_dict = {
+            key: value[0] for key, value in parse_qs(parsed_url.query).items()
+        }
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+        if random.random() < server.error_rate:
+            status, body = 500, b'Internal Server Error'
+        elif parsed_url.path.startswith('/api/'):
+            method_name = parsed_url.path[len('/api/'):]
+            status = 200
+            body = json.dumps(self.conduit(method_name, query_dict)).encode()
+        elif parsed_url.path.startswith('/r/changes/'):
+            status = 200
+            body = b")]}'\n" + json.dumps(self.gerrit(query_dict)).encode()
+        else:
+            status, body = 404, b'Not Found'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        server.record(time.time() - start_time, len(body), status)
+
+    def conduit(self, method_name, query_dict):
+        """ Return json data for a Conduit method"""
+        server = self.server
+        if method_name == 'user.mediawikiquery':
+            result = [
+                {'name': value, 'phid': user_phid(value)}
+                for key, value in query_dict.items()
+                if key.startswith('names[')
+            ]
+        elif method_name == 'maniphest.search':
+            start = int(query_dict.get('after') or 0)
+            end = min(start + SEARCH_PAGE_SIZE, server.task_count)
+            modified_start = int(
+                query_dict.get('constraints[modifiedStart]') or 0)
+            data_list = []
+            for task_id in range(start + 1, end + 1):
+                date_created = get_subs_epoch(task_id)
+                date_modified = date_created + server.transaction_count - 1
+                if date_modified >= modified_start:
+                    data_list.append({
+                        'id': task_id, 'type': 'TASK',
+                        'fields': {'dateCreated': date_created,
+                                   'dateModified': date_modified},
+                    })
+            result = {
+                'data': data_list,
+                'cursor': {'after': str(end) if end < server.task_count
+                           else None},
+            }
+        elif method_name == 'maniphest.gettasktransactions':
+            result = {
+                value: make_transactions(
+                    int(value), server.transaction_count,
+                    server.payload_bytes)
+                for key, value in query_dict.items() if key.startswith('ids[')
+            }
+        elif method_name == 'transaction.search':
+            task_id = int(query_dict['objectIdentifier'].lstrip('T'))
+            author_phid = query_dict.get('constraints[authorPHIDs][0]')
+            transaction_list = [
+                transaction for transaction in make_transactions(
+                    task_id, server.transaction_count, server.payload_bytes)
+                if author_phid in (None, transaction['authorPHID'])
+            ]
+            start = int(query_dict.get('after') or 0)
+            end = min(start + int(query_dict.get('limit', 100)),
+                      len(transaction_list))
+            result = {
+                'data': [
+                    to_search_transaction(transaction)
+                    for transaction in transaction_list[start:end]
+                ],
+                'cursor': {'after': str(end) if end < len(transaction_list)
+                           else None},
+            }
+        else:
+            return {'result': None, 'error_code': 'ERR-CONDUIT-CALL',
+                    'error_info': 'unknown method'}
+        return {'result': result, 'error_code': None, 'error_info': None}
+
+    def gerrit(self, query_dict):
+        """ Return a page of mock Gerrit changes, newest first"""
+        server = self.server
+        after, before = 0, float('inf')
+        status = None
+        owner_set = set()
+        for term in query_dict.get('q', '').split():
+            key, _, value = term.strip('()').partition(':')
+            if key == 'owner':
+                owner_set.add(value)
+            elif key == 'status':
+                status = 'NEW' if value == 'open' else value.upper()
+            elif key in ('after', 'before'):
+                day = calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+                if key == 'after':
+                    after = day
+                else:
+                    before = day
+        index_list = [
+            index for index in range(server.change_count - 1, -1, -1)
+            if after <= get_change_updated(index) <= before and (
+                status is None
+                or CHANGE_STATUSES[index % len(CHANGE_STATUSES)] == status)
+            and (not owner_set or get_owner_name(
+                index % server.owner_count) in owner_set)
+        ]
+        start = int(query_dict.get('S', 0))
+        page_size = int(query_dict.get('n', len(index_list)))
+        end = min(start + page_size, len(index_list))
+        detailed_accounts = query_dict.get('o') == 'DETAILED_ACCOUNTS'
+        change_list = [
+            make_change(index, server.owner_count, detailed_accounts)
+            for index in index_list[start:end]
+        ]
+        if change_list and end < len(index_list):
+            change_list[-1]['_more_changes'] = True
+        return change_list
+
+
+class MockServer(ThreadingHTTPServer):
+    """ Local stand-in for Phabricator and Gerrit"""
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, task_count, transaction_count, payload_bytes,
+                 change_count, latency, error_rate, owner_count=1):
+        super().__init__(('127.0.0.1', 0), MockHandler)
+        self.task_count = task_count
+        self.transaction_count = transaction_count
+        self.payload_bytes = payload_bytes
+        self.change_count = change_count
+        self.owner_count = owner_count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def record(self, elapsed, size, status):
+        """ Record one served request"""
+        with self.lock:
+            self.latency_list.append(elapsed)
+            self.bytes_sent += size
+            if status >= 500:
+                self.error_count += 1
+
+    def handle_error(self, request, client_address):
+        """ Ignore clients dropping keep-alive connections"""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def reset(self):
+        """ Clear recorded requests"""
+        with self.lock:
+            self.latency_list = []
+            self.bytes_sent = 0
+            self.error_count = 0
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+
+def run_requests(base_url, backend='serial'):
+    """ Run the requests engine of sync_requests.py on an execution backend"""
+    import client
+    import scanner
+    import sync_requests
+    client.BASE_URL = base_url + '/api/'
+    sync_requests.backend = backend
+    phid = sync_requests.get_user_phid(USERNAME)
+    task_id_list = sync_requests.get_user_subs_task(USERNAME)
+    transaction_dict = sync_requests.get_task_transactions(task_id_list)
+    scanner.collect_subs_dates(transaction_dict, task_id_list, phid)
+    return len(task_id_list)
+
+
+def run_gevent(base_url):
+    """ Run the gevent engine of async_requests.py"""
+    import client
+    import scanner
+    import async_requests
+    client.BASE_URL = base_url + '/api/'
+    async_requests.user_phid = async_requests.get_user_phid(USERNAME)
+    task_id_list = async_requests.get_user_subs_task(USERNAME)
+    params_list = async_requests.get_params(task_id_list)
+    json_response_list = async_requests.get_json_response(params_list)
+    transaction_dict = async_requests.get_task_transactions(
+        json_response_list)
+    scanner.collect_subs_dates(
+        transaction_dict, task_id_list, async_requests.user_phid)
+    return len(task_id_list)
+
+
+def run_asyncio(base_url):
+    """ Run the asyncio engine of task_statistics.py"""
+    import client
+    import task_statistics
+    client.BASE_URL = base_url + '/api/'
+    task_statistics.user_phid = task_statistics.get_user_phid(USERNAME)
+    task_id_list = task_statistics.get_user_subs_task(USERNAME)
+    transaction_dict = task_statistics.get_transactions(task_id_list)
+    task_statistics.get_subs_date(transaction_dict, task_id_list)
+    return len(task_id_list)
+
+
+def run_pipeline(base_url):
+    """ Run the pipelined search and fetch of task_statistics.py"""
+    import client
+    import task_statistics
+    client.BASE_URL = base_url + '/api/'
+    task_statistics.user_phid = task_statistics.get_user_phid(USERNAME)
+    subs_date_list, _ = task_statistics.get_subs_pipeline(USERNAME)
+    return len(subs_date_list)
+
+
+def run_workers(base_url, worker_count=4):
+    """ Run the pipeline of task_statistics.py, scanning in processes"""
+    import client
+    import task_statistics
+    from concurrent.futures import ProcessPoolExecutor
+    client.BASE_URL = base_url + '/api/'
+    task_statistics.user_phid = task_statistics.get_user_phid(USERNAME)
+    with ProcessPoolExecutor(worker_count) as scan_pool:
+        task_statistics.scan_pool = scan_pool
+        subs_date_list, _ = task_statistics.get_subs_pipeline(USERNAME)
+    return len(subs_date_list)
+
+
+def run_search(base_url):
+    """ Run the pipeline of task_statistics.py over transaction.search"""
+    import client
+    import task_statistics
+    client.BASE_URL = base_url + '/api/'
+    task_statistics.backend = 'search'
+    task_statistics.user_phid = task_statistics.get_user_phid(USERNAME)
+    subs_date_list, _ = task_statistics.get_subs_pipeline(USERNAME)
+    return len(subs_date_list)
+
+
+def run_gerrit(base_url):
+    """ Run the paginated Gerrit counter of issue_fetcher.py"""
+    import issue_fetcher
+    url = base_url + '/r/changes/?q='
+    query_params = issue_fetcher.clean_input(OWNER_NAME, None)
+    formatted_query = issue_fetcher.format_query_params(query_params)
+    change_iter = issue_fetcher.iter_gerrit_changes(url, formatted_query)
+    count_dict = issue_fetcher.get_status_counts(change_iter)
+    return sum(count_dict.values())
+
+
+def run_sharded(base_url):
+    """ Run the date-sharded Gerrit counter of issue_fetcher.py"""
+    import issue_fetcher
+    url = base_url + '/r/changes/?q='
+    query_params = issue_fetcher.clean_input(OWNER_NAME, None)
+    change_iter = issue_fetcher.iter_sharded_changes(
+        url, query_params, SHARD_START_DATE, SHARD_END_DATE,
+        adaptive=True)
+    count_dict = issue_fetcher.get_status_counts(change_iter)
+    return sum(count_dict.values())
+
+
+def run_report(base_url):
+    """ Run the single pass Gerrit change report of issue_fetcher.py"""
+    import issue_fetcher
+    url = base_url + '/r/changes/?q='
+    query_params = issue_fetcher.clean_input(OWNER_NAME, None)
+    formatted_query = (issue_fetcher.format_query_params(query_params)
+                       + issue_fetcher.get_query_options(
+                           issue_fetcher.REPORT_METRICS))
+    change_iter = issue_fetcher.iter_gerrit_changes(url, formatted_query)
+    report = issue_fetcher.get_change_stats(change_iter).get_report()
+    return sum(report['counts'].values())
+
+
+def run_team(base_url):
+    """ Run issue_fetcher.py's count once per owner of a team"""
+    import issue_fetcher
+    url = base_url + '/r/changes/?q='
+    change_count = 0
+    for owner_index in range(TEAM_SIZE):
+        query_params = issue_fetcher.clean_input(
+            get_owner_name(owner_index), None)
+        change_iter = issue_fetcher.iter_gerrit_changes(
+            url, issue_fetcher.format_query_params(query_params))
+        change_count += sum(
+            issue_fetcher.get_status_counts(change_iter).values())
+    return change_count
+
+
+def run_batch(base_url):
+    """ Run issue_fetcher.py's batched count of a team's owners"""
+    import issue_fetcher
+    url = base_url + '/r/changes/?q='
+    owner_list = [get_owner_name(index) for index in range(TEAM_SIZE)]
+    owner_count_dict = issue_fetcher.get_owner_status_counts(
+        url, owner_list, issue_fetcher.clean_input(None, None))
+    return sum(
+        sum(count_dict.values()) for count_dict in owner_count_dict.values())
+
+
+ENGINES = {
+    'sync': run_requests,
+    'thread': functools.partial(run_requests, backend='thread'),
+    'gevent': run_gevent,
+    'asyncio': run_asyncio,
+    'pipeline': run_pipeline,
+    'workers': run_workers,
+    'search': run_search,
+    'gerrit': run_gerrit,
+    'sharded': run_sharded,
+    'report': run_report,
+    'team': run_team,
+    'batch': run_batch,
+}
+# imported before timing starts so import cost is not measured
+ENGINE_MODULES = {
+    'sync': 'sync_requests',
+    'thread': 'sync_requests',
+    'gevent': 'async_requests',
+    'asyncio': 'task_statistics',
+    'pipeline': 'task_statistics',
+    'workers': 'task_statistics',
+    'search': 'task_statistics',
+    'gerrit': 'issue_fetcher',
+    'sharded': 'issue_fetcher',
+    'report': 'issue_fetcher',
+    'team': 'issue_fetcher',
+    'batch': 'issue_fetcher',
+}
+
+
+def run_engine(engine_name, base_url):
+    """ Run one engine in this process and print its measurements"""
+    importlib.import_module(ENGINE_MODULES[engine_name])
+    start_time = time.time()
+    item_count = ENGINES[engine_name](base_url)
+    elapsed = time.time() - start_time
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'items': item_count,
+        'elapsed': elapsed,
+        'peak_rss_kb': peak_rss,
+    }))
+
+
+def benchmark_engine(server, engine_name, repeat):
+    """
+    Run engine repeat times in fresh processes against
+    server and return summary of its measurements
+    """
+    elapsed_list = []
+    latency_list = []
+    rss_list = []
+    request_count = 0
+    bytes_sent = 0
+    error_count = 0
+    failed_runs = 0
+    for _ in range(repeat):
+        server.reset()
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--run-engine', engine_name, '--base-url', server.base_url],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True
+        )
+        output_lines = process.stdout.strip().splitlines()
+        try:
+            run_dict = json.loads(output_lines[-1])
+        except (IndexError, ValueError):
+            run_dict = None
+        if process.returncode != 0 or run_dict is None:
+            failed_runs += 1
+        else:
+            elapsed_list.append(run_dict['elapsed'])
+            rss_list.append(run_dict['peak_rss_kb'])
+        with server.lock:
+            latency_list.extend(server.latency_list)
+            request_count += len(server.latency_list)
+            bytes_sent += server.bytes_sent
+            error_count += server.error_count
+
+    total_elapsed = sum(elapsed_list)
+    return {
+        'engine': engine_name,
+        'runs': repeat,
+        'failed_runs': failed_runs,
+        'requests': request_count,
+        'bytes': bytes_sent,
+        'server_errors': error_count,
+        'elapsed_p50': percentile(elapsed_list, 50),
+        'throughput': request_count / total_elapsed if total_elapsed else 0,
+        'latency_p50_ms': percentile(latency_list, 50) * 1000,
+        'latency_p99_ms': percentile(latency_list, 99) * 1000,
+        'peak_rss_mb': max(rss_list, default=0) / 1024,
+    }
+
+
+def print_summary(summary_list):
+    """ Print benchmark summaries as a table"""
+    column_list = [
+        ('engine', '{}'), ('runs', '{}'), ('failed_runs', '{}'),
+        ('requests', '{}'), ('elapsed_p50', '{:.2f}'),
+        ('throughput', '{:.1f}'), ('latency_p50_ms', '{:.1f}'),
+        ('latency_p99_ms', '{:.1f}'), ('peak_rss_mb', '{:.1f}'),
+    ]
+    header = ' | '.join(name.rjust(14) for name, _ in column_list)
+    print(header)
+    print('-' * len(header))
+    for summary in summary_list:
+        print(' | '.join(
+            fmt.format(summary[name]).rjust(14) for name, fmt in column_list
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark fetch engines against a local mock server')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=list(ENGINES))
+    parser.add_argument('--tasks', type=int, default=1000,
+                        help='number of subscribed tasks')
+    parser.add_argument('--transactions', type=int, default=20,
+                        help='transactions per task')
+    parser.add_argument('--payload-bytes', type=int, default=200,
+                        help='comment bytes per transaction')
+    parser.add_argument('--changes', type=int, default=2000,
+                        help='number of Gerrit changes')
+    parser.add_argument('--owners', type=int, default=1,
+                        help='number of Gerrit owners changes are spread '
+                        'over, the team engines query {}'.format(TEAM_SIZE))
+    parser.add_argument('--latency', type=float, default=20,
+                        help='mean server latency in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests answered with 500')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true',
+                        help='print summaries as json')
+    parser.add_argument('--run-engine', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_engine:
+        run_engine(args.run_engine, args.base_url)
+        sys.exit()
+
+    server = MockServer(args.tasks, args.transactions, args.payload_bytes,
+                        args.changes, args.latency / 1000, args.error_rate,
+                        args.owners)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    summary_list = [
+        benchmark_engine(server, engine_name, args.repeat)
+        for engine_name in args.engines
+    ]
+    server.shutdown()
+    if args.json:
+        print(json.dumps(summary_list, indent=2))
+    else:
+        print_summary(summary_list)
@@ -0,0 +1,238 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+CACHE_PATH = 'response_cache.sqlite'
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Seconds a cached response stays fresh, None never expires
+METHOD_TTL = {
+    'user.mediawikiquery': None,
+    'maniphest.search': HOUR,
+    'maniphest.gettasktransactions': DAY,
+    'transaction.search': DAY,
+    'gerrit.changes': HOUR,
+}
+DEFAULT_TTL = HOUR
+
+TRANSACTION_METHOD = 'maniphest.gettasktransactions'
+CLOSED_TASK_STATUSES = ('resolved', 'declined', 'invalid', 'duplicate')
+CLOSED_CHANGE_STATUSES = ('MERGED', 'ABANDONED')
+
+
+def normalize_params(query_params):
+    """ Return query parameters as a stable cache key string"""
+    param_list = sorted(
+        (str(key), str(value)) for key, value in query_params.items()
+        if key != 'api.token'
+    )
+    return json.dumps(param_list, separators=(',', ':'))
+
+
+def is_closed_task(transaction_list):
+    """ Return True if last status change of a task closed it"""
+    status_list = [
+        transaction for transaction in transaction_list
+        if transaction['transactionType'] == 'status'
+    ]
+    if not status_list:
+        return False
+    last_status = max(status_list, key=lambda tx: int(tx['dateCreated']))
+    return last_status['newValue'] in CLOSED_TASK_STATUSES
+
+
+def is_closed_change_list(change_list):
+    """ Return True if every change is merged or abandoned"""
+    return all(
+        change['status'] in CLOSED_CHANGE_STATUSES for change in change_list
+    )
+
+
+class ResponseCache:
+    """
+    SQLite backed cache of api responses keyed by method name
+    and normalized query parameters, safe to share between threads
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_CACHE_BYTES,
+                 method_ttl=METHOD_TTL):
+        self.max_bytes = max_bytes
+        self.method_ttl = method_ttl
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS response ('
+            ' method TEXT, params TEXT, body TEXT, size INTEGER,'
+            ' expires REAL, last_access REAL,'
+            ' PRIMARY KEY (method, params))'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS response_lru'
+            ' ON response (last_access)'
+        )
+        row = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM response').fetchone()
+        self.total_bytes = row[0]
+
+    def get(self, method_name, query_params):
+        """ Return cached json data or None if missing or expired"""
+        with self.lock:
+            json_data = self.lookup(method_name, query_params)
+            self.connection.commit()
+        return json_data
+
+    def lookup(self, method_name, query_params):
+        """ Same as get, without committing the access time"""
+        body = self.lookup_text(method_name, query_params)
+        if body is None:
+            return None
+        return json.loads(body)
+
+    def lookup_text(self, method_name, query_params):
+        """ Same as lookup, returning the json text undecoded"""
+        params = normalize_params(query_params)
+        row = self.connection.execute(
+            'SELECT body, expires FROM response'
+            ' WHERE method = ? AND params = ?', (method_name, params)
+        ).fetchone()
+        if row is None:
+            return None
+        body, expires = row
+        now = time.time()
+        if expires is not None and expires < now:
+            self.delete(method_name, params)
+            return None
+        self.connection.execute(
+            'UPDATE response SET last_access = ?'
+            ' WHERE method = ? AND params = ?', (now, method_name, params)
+        )
+        return body
+
+    def set(self, method_name, query_params, json_data, permanent=False):
+        """
+        Store json data, permanent entries never
+        expire but can still be evicted for space
+        """
+        with self.lock:
+            self.insert(method_name, query_params, json_data, permanent)
+            self.evict()
+            self.connection.commit()
+
+    def insert(self, method_name, query_params, json_data, permanent=False):
+        """ Same as set, without eviction and commit"""
+        self.insert_text(method_name, query_params,
+                         json.dumps(json_data, separators=(',', ':')),
+                         permanent)
+
+    def insert_text(self, method_name, query_params, body, permanent=False):
+        """ Same as insert, for data already encoded as json text"""
+        params = normalize_params(query_params)
+        now = time.time()
+        ttl = self.method_ttl.get(method_name, DEFAULT_TTL)
+        if permanent or ttl is None:
+            expires = None
+        else:
+            expires = now + ttl
+        self.delete(method_name, params)
+        self.connection.execute(
+            'INSERT INTO response VALUES (?, ?, ?, ?, ?, ?)',
+            (method_name, params, body, len(body), expires, now)
+        )
+        self.total_bytes += len(body)
+
+    def delete(self, method_name, params):
+        """ Remove an entry given its normalized parameters"""
+        row = self.connection.execute(
+            'SELECT size FROM response WHERE method = ? AND params = ?',
+            (method_name, params)
+        ).fetchone()
+        if row is not None:
+            self.connection.execute(
+                'DELETE FROM response WHERE method = ? AND params = ?',
+                (method_name, params)
+            )
+            self.total_bytes -= row[0]
+
+    def evict(self):
+        """ Drop least recently used entries until under max_bytes"""
+        while self.total_bytes > self.max_bytes:
+            row = self.connection.execute(
+                'SELECT method, params, size FROM response'
+                ' ORDER BY last_access LIMIT 1'
+            ).fetchone()
+            if row is None:
+                break
+            self.delete(row[0], row[1])
+
+    def get_transactions(self, task_id_list):
+        """
+        Return dictionary of cached transactions
+        and list of task id's missing from cache
+        """
+        transaction_dict = {}
+        missing_id_list = []
+        with self.lock:
+            for task_id in task_id_list:
+                json_data = self.lookup(
+                    TRANSACTION_METHOD, {'ids[0]': task_id})
+                if json_data is None:
+                    missing_id_list.append(task_id)
+                else:
+                    transaction_dict.update(json_data['result'])
+            self.connection.commit()
+
+        return transaction_dict, missing_id_list
+
+    def set_transactions(self, transaction_dict):
+        """
+        Store transactions of each task separately,
+        transactions of closed tasks never expire
+        """
+        with self.lock:
+            for task_id, transaction_list in transaction_dict.items():
+                json_data = {'result': {task_id: transaction_list}}
+                permanent = is_closed_task(transaction_list)
+                self.insert(TRANSACTION_METHOD, {'ids[0]': task_id},
+                            json_data, permanent)
+            self.evict()
+            self.connection.commit()
+
+    def get_transaction_texts(self, task_id_list):
+        """
+        Return list of cached transaction responses as json
+        text, one per task, and list of task id's missing
+        """
+        body_list = []
+        missing_id_list = []
+        with self.lock:
+            for task_id in task_id_list:
+                body = self.lookup_text(
+                    TRANSACTION_METHOD, {'ids[0]': task_id})
+                if body is None:
+                    missing_id_list.append(task_id)
+                else:
+                    body_list.append(body)
+            self.connection.commit()
+
+        return body_list, missing_id_list
+
+    def set_transaction_texts(self, text_dict):
+        """
+        Store json text of each task's transactions
+        given with whether the task is closed
+        """
+        with self.lock:
+            for task_id, (body, permanent) in text_dict.items():
+                self.insert_text(TRANSACTION_METHOD, {'ids[0]': task_id},
+                                 body, permanent)
+            self.evict()
+            self.connection.commit()
+
+    def close(self):
+        """ Close the database connection"""
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,391 @@
+import os
+import sys
+import time
+import asyncio
+import datetime
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from metrics import metrics
+from retry import (MAX_RETRIES, RetryError, backoff_delay, get_retry_after,
+                   is_retryable_status, send_with_retry)
+from scanner import loads
+from scheduler import AIMDController, get_bucket
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+BASE_URL = os.environ.get(
+    'PHABRICATOR_URL', 'https://phabricator.wikimedia.org/api/')
+API_KEY = os.environ.get('PHABRICATOR_API_KEY', 'YOUR API-KEY HERE')
+GERRIT_URL = os.environ.get(
+    'GERRIT_URL', 'http://gerrit.wikimedia.org/r/changes/?q=')
+BATCH_SIZE = 100
+CONCURRENCY = 20
+MAX_CONCURRENCY = 64
+# keep-alive connections per host, enough for MAX_CONCURRENCY threads
+POOL_SIZE = MAX_CONCURRENCY
+REQUEST_TIMEOUT = 60
+EXECUTION_BACKENDS = ('serial', 'thread', 'gevent', 'asyncio')
+cache = None
+session = None
+
+
+class FetchError(Exception):
+    """ Raised when a response the caller can't do without failed"""
+
+
+def logger(error_code, error_message):
+    """ Print error message"""
+    print('Error : {}'.format(error_message))
+
+
+def open_session(pool_size=POOL_SIZE):
+    """
+    Return requests session keeping pool_size
+    gzip enabled connections alive per host
+    """
+    pooled_session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size)
+    pooled_session.mount('http://', adapter)
+    pooled_session.mount('https://', adapter)
+    pooled_session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return pooled_session
+
+
+def get_session():
+    """ Return the shared requests session, opening it on first use"""
+    global session
+    if session is None:
+        session = open_session()
+    return session
+
+
+def get_method_url(method_name, query_params):
+    """ Return Conduit url of method_name called with query_params"""
+    return BASE_URL + method_name + '?' + urlencode(
+        dict(query_params, **{'api.token': API_KEY}))
+
+
+def fetch_data(method_name, query_params, use_cache=True, required=True):
+    """
+    Return json response for
+    given method name and parameters,
+    None on failure unless required
+    """
+    use_cache = use_cache and cache is not None
+    if use_cache:
+        cached_data = cache.get(method_name, query_params)
+        if cached_data is not None:
+            metrics.record_cache_hit(method_name)
+            return cached_data
+    url = BASE_URL + method_name
+    query_params['api.token'] = API_KEY
+
+    def send_request():
+        get_bucket(url).acquire()
+        start_time = time.perf_counter()
+        response = get_session().get(url, params=query_params)
+        metrics.record_request(
+            method_name, time.perf_counter() - start_time,
+            len(response.content), response.status_code)
+        return response
+
+    try:
+        response = send_with_retry(send_request, method_name)
+        with metrics.phase('parse'):
+            json_data = response.json()
+    except (RetryError, ValueError) as e:
+        error_message = 'please enter a valid url'
+        logger(e, error_message)
+        if not required:
+            return None
+        sys.exit()
+    if use_cache and json_data.get('error_code') is None:
+        cache.set(method_name, query_params, json_data)
+    return json_data
+
+
+def open_async_session(timeout=REQUEST_TIMEOUT):
+    """ Return aiohttp session over a shared keep-alive connection pool"""
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout)
+
+
+async def fetch_bytes(session, controller, url,
+                      method_name='maniphest.gettasktransactions'):
+    """
+    Return raw response body for given url, retrying failed
+    requests with backoff, None once retries run out
+    """
+    bucket = get_bucket(url)
+    for attempt in range(MAX_RETRIES + 1):
+        retry_after = None
+        await controller.acquire()
+        await bucket.acquire_async()
+        start_time = time.perf_counter()
+        ok = False
+        try:
+            async with session.get(url) as response:
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        else:
+            metrics.record_request(
+                method_name, time.perf_counter() - start_time,
+                len(body), response.status)
+            ok = not is_retryable_status(response.status)
+            error = 'HTTP {}'.format(response.status)
+            retry_after = get_retry_after(response.headers.get('Retry-After'))
+        finally:
+            await controller.release(time.perf_counter() - start_time, ok)
+        if ok:
+            break
+        if attempt == MAX_RETRIES:
+            logger(error, 'Request Failed')
+            return None
+        metrics.record_retry(method_name)
+        await asyncio.sleep(backoff_delay(attempt, retry_after))
+    return body
+
+
+async def fetch_json(session, controller, url,
+                     method_name='maniphest.gettasktransactions'):
+    """
+    Return decoded json response for given url, retrying
+    failed requests with backoff, None once retries run out
+    """
+    body = await fetch_bytes(session, controller, url, method_name)
+    if body is None:
+        return None
+    try:
+        with metrics.phase('parse'):
+            return loads(body)
+    except ValueError as e:
+        error_message = "unable to decode json"
+        logger(e, error_message)
+        return None
+
+
+async def fetch_method(session, controller, method_name, query_params,
+                       use_cache=True, refresh=False):
+    """
+    Return json response of a Conduit method over an aiohttp session,
+    using cache if set, None on failure, refresh skips cached responses
+    """
+    use_cache = use_cache and cache is not None
+    if use_cache and not refresh:
+        json_data = cache.get(method_name, query_params)
+        if json_data is not None:
+            metrics.record_cache_hit(method_name)
+            return json_data
+    json_data = await fetch_json(
+        session, controller, get_method_url(method_name, query_params),
+        method_name)
+    if json_data is None or json_data.get('result') is None:
+        return None
+    if use_cache:
+        cache.set(method_name, query_params, json_data)
+    return json_data
+
+
+async def fetch_many_async(method_name, query_params_list, concurrency):
+    """ Return json responses of method_name over a new aiohttp session"""
+    controller = AIMDController(concurrency, max_limit=MAX_CONCURRENCY)
+    async with open_async_session() as session:
+        return await asyncio.gather(*[
+            fetch_method(session, controller, method_name, query_params,
+                         use_cache=False)
+            for query_params in query_params_list
+        ])
+
+
+def fetch_many(method_name, query_params_list, backend='thread',
+               concurrency=CONCURRENCY):
+    """
+    Return json responses of method_name called with each of
+    query_params_list, in order and None for failed calls,
+    sent concurrently by the given backend
+    """
+    def fetch_one(query_params):
+        return fetch_data(method_name, dict(query_params), use_cache=False,
+                          required=False)
+
+    if backend == 'serial':
+        return [fetch_one(query_params) for query_params in query_params_list]
+    if backend == 'thread':
+        with ThreadPoolExecutor(min(concurrency, POOL_SIZE)) as executor:
+            return list(executor.map(fetch_one, query_params_list))
+    if backend == 'gevent':
+        # callers monkey patch the standard library before importing this
+        import gevent.pool
+        return gevent.pool.Pool(min(concurrency, POOL_SIZE)).map(
+            fetch_one, query_params_list)
+    if backend == 'asyncio':
+        return asyncio.run(fetch_many_async(
+            method_name, query_params_list, concurrency))
+    raise ValueError('unknown backend {}'.format(backend))
+
+
+def get_ids_params(task_id_chunk):
+    """ Return maniphest.gettasktransactions parameters of a batch of tasks"""
+    query_params = {}
+    for index, task_id in enumerate(task_id_chunk):
+        query_params['ids[{}]'.format(index)] = task_id
+    return query_params
+
+
+def chunk_list(item_list, chunk_size):
+    """ Return list split into chunks of given size"""
+    return [
+        item_list[index:index + chunk_size]
+        for index in range(0, len(item_list), chunk_size)
+    ]
+
+
+def get_user_phid(username):
+    """ Return user's PhID"""
+    method_name = 'user.mediawikiquery'
+    query_params = {
+        'names[0]': username,
+    }
+    json_data = fetch_data(method_name, query_params)
+    result_dict = json_data['result']
+    try:
+        user_phid = result_dict[0]['phid']
+    except TypeError:
+        error_code = json_data['error_code']
+        error_message = json_data['error_info']
+        logger(error_code, error_message)
+        sys.exit()
+
+    return user_phid
+
+
+def get_user_phids(username_list):
+    """
+    Return dictionary mapping username to PhID,
+    resolving users in batches
+    """
+    method_name = 'user.mediawikiquery'
+    phid_dict = {}
+    for username_chunk in chunk_list(username_list, BATCH_SIZE):
+        query_params = {}
+        for index, username in enumerate(username_chunk):
+            query_params['names[{}]'.format(index)] = username
+        json_data = fetch_data(method_name, query_params)
+        result_list = json_data['result']
+        if not isinstance(result_list, list):
+            error_code = json_data['error_code']
+            error_message = json_data['error_info']
+            logger(error_code, error_message)
+            sys.exit()
+        for user_dict in result_list:
+            phid_dict[user_dict['name']] = user_dict['phid']
+
+    for username in username_list:
+        if username not in phid_dict:
+            logger(None, 'unknown user {}'.format(username))
+
+    return phid_dict
+
+
+def get_search_params(username, modified_start=None):
+    """
+    Return maniphest.search parameters of tasks user is
+    subscribed to, modified since modified_start if given
+    """
+    query_params = {
+        'constraints[subscribers][0]': username,
+    }
+    if modified_start is not None:
+        # in the default id order, so a task modified while paging
+        # keeps its place instead of jumping ahead of the cursor
+        query_params['constraints[modifiedStart]'] = modified_start
+    return query_params
+
+
+def get_page_task_ids(result_dict, created_end=None):
+    """
+    Return task id's of a maniphest.search page, skipping tasks
+    created at or after created_end as they can't have been
+    subscribed to before it
+    """
+    task_id_list = []
+    for data_dict in result_dict['data']:
+        if data_dict['type'] != 'TASK':
+            continue
+        date_created = data_dict.get('fields', {}).get('dateCreated')
+        if (created_end is not None and date_created is not None
+                and int(date_created) >= created_end):
+            continue
+        task_id_list.append(data_dict['id'])
+    return task_id_list
+
+
+def is_last_page(result_dict):
+    """ Return True if no maniphest.search page follows result_dict"""
+    return not result_dict['cursor']['after']
+
+
+def get_user_subs_task(username, modified_start=None, created_end=None):
+    """
+    Return list of task id's on user is subscribed to, modified
+    since modified_start and created before created_end if given
+    """
+    method_name = 'maniphest.search'
+    query_params = get_search_params(username, modified_start)
+    task_id_list = []
+    # Handling pagination in API
+    while True:
+        json_data = fetch_data(method_name, query_params)
+        result_dict = json_data['result']
+        task_id_list.extend(get_page_task_ids(result_dict, created_end))
+        if is_last_page(result_dict):
+            break
+        next_page = result_dict['cursor']['after']
+        query_params = dict(query_params, after=next_page)
+
+    return task_id_list
+
+
+def get_clean_date(date_string):
+    """ Return cleaned date"""
+    try:
+        date_object = datetime.datetime.strptime(date_string, '%Y-%m')
+    except ValueError as e:
+        error_message = 'please enter date in yyyy-mm format'
+        logger(e, error_message)
+        sys.exit()
+
+    return date_object
+
+
+def get_clean_day(date_string):
+    """ Return cleaned yyyy-mm-dd date"""
+    try:
+        date_object = datetime.datetime.strptime(date_string, '%Y-%m-%d')
+    except ValueError as e:
+        error_message = 'please enter date in yyyy-mm-dd format'
+        logger(e, error_message)
+        sys.exit()
+
+    return date_object
+
+
+def get_window(start_date, end_date):
+    """
+    Return epochs of the start of start_date and the
+    end of end_date, the dates being in local time
+    """
+    start_day = datetime.datetime(
+        start_date.year, start_date.month, start_date.day)
+    end_day = datetime.datetime(
+        end_date.year, end_date.month, end_date.day) + datetime.timedelta(1)
+    return (int(time.mktime(start_day.timetuple())),
+            int(time.mktime(end_day.timetuple())))
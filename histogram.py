@@ -0,0 +1,179 @@
+import time
+import numpy as np
+
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter')
+SECONDS_PER_DAY = 24 * 60 * 60
+# 1970-01-01 was a Thursday, shift day numbers so weeks start on Monday
+MONDAY_SHIFT = 3
+
+
+def get_local_day(epoch):
+    """ Return local day number since 1970-01-01 of an epoch"""
+    return (epoch + time.localtime(epoch).tm_gmtoff) // SECONDS_PER_DAY
+
+
+def to_days(epoch_list):
+    """
+    Return array of local day numbers since 1970-01-01 for epochs,
+    with one offset lookup per UTC day and per epoch only on
+    days the UTC offset changes
+    """
+    epoch_array = np.asarray(epoch_list, dtype=np.int64)
+    if not epoch_array.size:
+        return epoch_array
+    utc_day_array = epoch_array // SECONDS_PER_DAY
+    first_day = int(utc_day_array.min())
+    # offsets at the start of each UTC day and of the day after the last
+    day_offsets = np.array([
+        time.localtime(day * SECONDS_PER_DAY).tm_gmtoff
+        for day in range(first_day, int(utc_day_array.max()) + 2)
+    ], dtype=np.int64)
+    day_index = utc_day_array - first_day
+    offset_array = day_offsets[day_index]
+    changing = (day_offsets[:-1] != day_offsets[1:])[day_index]
+    offset_array[changing] = [
+        time.localtime(epoch).tm_gmtoff
+        for epoch in epoch_array[changing].tolist()
+    ]
+    return (epoch_array + offset_array) // SECONDS_PER_DAY
+
+
+def get_bin_edges(start_date, end_date, granularity):
+    """
+    Return day numbers of bin starts covering start_date
+    to end_date, followed by the end of the last bin
+    """
+    start_day = np.datetime64(start_date, 'D').astype(np.int64)
+    end_day = np.datetime64(end_date, 'D').astype(np.int64)
+    if granularity == 'day':
+        return np.arange(start_day, end_day + 2)
+    if granularity == 'week':
+        first_day = start_day - (start_day + MONDAY_SHIFT) % 7
+        return np.arange(first_day, end_day + 8, 7)
+    start_month = np.datetime64(start_date, 'M').astype(np.int64)
+    end_month = np.datetime64(end_date, 'M').astype(np.int64)
+    if granularity == 'month':
+        month_edges = np.arange(start_month, end_month + 2)
+    elif granularity == 'quarter':
+        first_month = start_month - start_month % 3
+        month_edges = np.arange(first_month, end_month + 4, 3)
+    else:
+        raise ValueError('unknown granularity {}'.format(granularity))
+    return month_edges.astype('datetime64[M]').astype(
+        'datetime64[D]').astype(np.int64)
+
+
+def get_bin_labels(bin_start_days, granularity):
+    """ Return a readable label for each bin start"""
+    label_list = []
+    for day in bin_start_days.astype('datetime64[D]').tolist():
+        if granularity == 'day':
+            label_list.append(day.isoformat())
+        elif granularity == 'week':
+            iso_year, iso_week, _ = day.isocalendar()
+            label_list.append('{}-W{:02d}'.format(iso_year, iso_week))
+        elif granularity == 'month':
+            label_list.append('{}-{:02d}'.format(day.year, day.month))
+        else:
+            label_list.append(
+                '{}-Q{}'.format(day.year, (day.month - 1) // 3 + 1))
+    return label_list
+
+
+def bin_user_epochs(epoch_dict, start_date, end_date, granularity='week'):
+    """
+    Return bin start days and dictionary mapping each user to counts of
+    epochs per bin between start_date and end_date, in a single pass
+    """
+    edge_days = get_bin_edges(start_date, end_date, granularity)
+    bin_count = len(edge_days) - 1
+    user_list = list(epoch_dict)
+    size_list = [len(epoch_dict[user]) for user in user_list]
+    if sum(size_list):
+        day_array = to_days(
+            np.concatenate([
+                np.asarray(epoch_dict[user], dtype=np.int64)
+                for user in user_list
+            ]))
+    else:
+        day_array = np.zeros(0, dtype=np.int64)
+    user_index = np.repeat(np.arange(len(user_list)), size_list)
+    first_day = np.datetime64(start_date, 'D').astype(np.int64)
+    last_day = np.datetime64(end_date, 'D').astype(np.int64)
+    bin_index = np.searchsorted(edge_days, day_array, side='right') - 1
+    in_range = (day_array >= first_day) & (day_array <= last_day)
+    flat_index = user_index[in_range] * bin_count + bin_index[in_range]
+    count_matrix = np.bincount(
+        flat_index, minlength=len(user_list) * bin_count
+    ).reshape(len(user_list), bin_count)
+    count_dict = dict(zip(user_list, count_matrix))
+    return edge_days[:-1], count_dict
+
+
+def bin_epochs(epoch_list, start_date, end_date, granularity='week'):
+    """ Return bin start days and counts of epochs per bin"""
+    bin_start_days, count_dict = bin_user_epochs(
+        {None: epoch_list}, start_date, end_date, granularity)
+    return bin_start_days, count_dict[None]
+
+
+def bin_day_counts(day_count_dict, start_date, end_date, granularity='week'):
+    """
+    Return bin start days and sums per bin of counts keyed
+    by day number, between start_date and end_date
+    """
+    edge_days = get_bin_edges(start_date, end_date, granularity)
+    day_array = np.fromiter(day_count_dict, dtype=np.int64,
+                            count=len(day_count_dict))
+    count_array = np.fromiter(day_count_dict.values(), dtype=np.int64,
+                              count=len(day_count_dict))
+    first_day = np.datetime64(start_date, 'D').astype(np.int64)
+    last_day = np.datetime64(end_date, 'D').astype(np.int64)
+    in_range = (day_array >= first_day) & (day_array <= last_day)
+    bin_index = np.searchsorted(
+        edge_days, day_array[in_range], side='right') - 1
+    counts = np.bincount(bin_index, weights=count_array[in_range],
+                         minlength=len(edge_days) - 1).astype(np.int64)
+    return edge_days[:-1], counts
+
+
+def get_month_week_counts(epoch_list, month_date):
+    """
+    Return dictionary mapping week number of the month of
+    month_date, as text from '1', to the count of epochs in it
+    """
+    return {
+        str(week_index + 1): int(count)
+        for week_index, count in enumerate(
+            bin_month_weeks(epoch_list, month_date))
+    }
+
+
+def print_period_counts(count_dict, period_name='Week',
+                        column_name='Subscription'):
+    """ Print a table of counts per period"""
+    width = max(len(period) for period in [period_name, *count_dict]) + 2
+    border = '+' + '-' * width + '+---------------+'
+    print(border)
+    print('|', period_name.center(width, ' '), '|',
+          column_name.center(15, ' '), '|', sep='')
+    print(border)
+    for period, count in count_dict.items():
+        print('|', period.center(width, ' '), '|',
+              str(count).center(15, ' '), '|', sep='')
+    print(border)
+
+
+def bin_month_weeks(epoch_list, month_date):
+    """
+    Return counts of epochs in the month of month_date, split
+    into five buckets of seven days from the first of the month
+    """
+    month_start = np.datetime64(month_date.strftime('%Y-%m'), 'M')
+    first_day = month_start.astype('datetime64[D]').astype(np.int64)
+    next_month = (month_start + 1).astype('datetime64[D]').astype(np.int64)
+    day_array = to_days(epoch_list)
+    in_month = (day_array >= first_day) & (day_array < next_month)
+    week_index = (day_array[in_month] - first_day) // 7
+    return np.bincount(week_index, minlength=5)
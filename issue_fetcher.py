@@ -1,41 +1,73 @@
-import requests
 import json
 import sys
-from datetime import datetime
-from collections import Counter
+import time
+import codecs
+import argparse
+import calendar
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+import client
+from activity_index import MERGED, ActivityIndex, to_day
+from cache import ResponseCache, is_closed_change_list
+from client import get_clean_day, get_session, logger
+from histogram import SECONDS_PER_DAY, get_local_day
+from metrics import metrics
+from retry import RetryError, send_with_retry
+from sketch import LogSketch
+from store import ChangeStore
+
+GERRIT_METHOD = 'gerrit.changes'
+PAGE_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+XSSI_PREFIX = b")]}'"
+SHARD_WORKERS = 8
+# first Gerrit release, a sharded query without a start date begins here
+GERRIT_START_DATE = '2009-01-01'
+# incremental counts refetch an owner's whole history this often
+RECONCILE_DAYS = 7
+# longest q= of a batch query, well under common url length limits
+MAX_QUERY_LENGTH = 2000
+# o= options each report metric needs, the fields of plain counts,
+# sizes, projects, branches and merge times are in every change
+METRIC_OPTIONS = {
+    'status': (),
+    'size': (),
+    'project': (),
+    'branch': (),
+    'time_to_merge': (),
+    'owner': ('DETAILED_ACCOUNTS',),
+}
+REPORT_METRICS = ('status', 'size', 'project', 'branch', 'time_to_merge')
+PERCENTILES = (50, 90, 99)
+TOP_COUNT = 10
 
 
 class StatusType:
     MERGED = 'MERGED'
     OPEN = 'OPEN'
+    ABANDONED = 'ABANDONED'
 
 
-def logger(error_code, error_message):
-    """ Print error message"""
-    print(error_message)
-
-
-def clean_date(date_string):
-    """ Clean date"""
-    try:
-        datetime.strptime(date_string, '%Y-%m-%d')
-    except ValueError as e:
-        error_message = "please enter date in yyyy-mm-dd format"
-        logger(e, error_message)
-        sys.exit()
+# Gerrit reports open changes with status NEW
+CHANGE_STATUS = {
+    'NEW': StatusType.OPEN,
+    'MERGED': StatusType.MERGED,
+    'ABANDONED': StatusType.ABANDONED,
+}
 
 
 def clean_input(owner_name, status, start_date=None, end_date=None):
     """ Clean user input and create query parameters"""
     query_params = {
-        'status': status,
         'owner': owner_name
     }
+    if status:
+        query_params['status'] = status
     if start_date or start_date == '':
-        clean_date(start_date)
+        get_clean_day(start_date)
         query_params['after'] = start_date
     if end_date or end_date == '':
-        clean_date(end_date)
+        get_clean_day(end_date)
         query_params['before'] = end_date
 
     return query_params
@@ -53,53 +85,643 @@ def format_query_params(query_params):
     return formatted_query
 
 
+def get_query_options(metric_list):
+    """ Return o= parameters needed by metrics, empty if none are"""
+    option_list = []
+    for metric in metric_list:
+        for option in METRIC_OPTIONS[metric]:
+            if option not in option_list:
+                option_list.append(option)
+    return ''.join('&o={}'.format(option) for option in option_list)
+
+
+def is_settled_query(formatted_query):
+    """ Return True if query ends with a before: date in the past"""
+    query = formatted_query.split('&')[0]
+    for query_string in query.split('+'):
+        if query_string.startswith('before:'):
+            before_date = datetime.strptime(query_string[7:], '%Y-%m-%d')
+            return before_date < datetime.now()
+    return False
+
+
+def strip_xssi_prefix(chunk_iter):
+    """ Yield chunks of bytes with Gerrit's XSSI prefix removed"""
+    chunk_iter = iter(chunk_iter)
+    head = b''
+    for chunk in chunk_iter:
+        head += chunk
+        if len(head) >= len(XSSI_PREFIX):
+            break
+    if head.startswith(XSSI_PREFIX):
+        head = head[len(XSSI_PREFIX):]
+    yield head
+    for chunk in chunk_iter:
+        yield chunk
+
+
+def iter_json_array(chunk_iter):
+    """
+    Yield elements of a json array one at a
+    time while reading it in chunks of bytes
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    index = 0
+    in_array = False
+    finished = False
+    chunk_iter = iter(chunk_iter)
+    while True:
+        while index < len(buffer) and buffer[index] in ' \t\r\n,':
+            index += 1
+        if index < len(buffer):
+            if not in_array:
+                if buffer[index] != '[':
+                    raise json.decoder.JSONDecodeError(
+                        'Expecting array', buffer, index)
+                in_array = True
+                index += 1
+                continue
+            if buffer[index] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, index)
+            except json.decoder.JSONDecodeError:
+                if finished:
+                    raise
+            else:
+                # a value ending the buffer may still be incomplete
+                if end < len(buffer) or finished:
+                    index = end
+                    yield element
+                    continue
+        if finished:
+            raise json.decoder.JSONDecodeError(
+                'Unterminated array', buffer, index)
+        buffer = buffer[index:]
+        index = 0
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            finished = True
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+
+
 def fetech_gerrit_data(url, formatted_query):
-    """ Gets json response from given queries"""
+    """
+    Yield changes for given query, decoding
+    them one at a time as the response streams
+    """
+    cache_params = {'url': url, 'q': formatted_query}
+    if client.cache is not None:
+        cached_data = client.cache.get(GERRIT_METHOD, cache_params)
+        if cached_data is not None:
+            metrics.record_cache_hit(GERRIT_METHOD)
+            yield from cached_data
+            return
     url += formatted_query
+    start_time = time.perf_counter()
     try:
-        response = requests.get(url)
-    except requests.exceptions.RequestException as e:
+        response = send_with_retry(
+            lambda: get_session().get(url, stream=True), GERRIT_METHOD)
+    except RetryError as e:
         error_message = "please enter a valid url"
         logger(e, error_message)
         sys.exit()
-    response_text = response.text
-    response_text = response_text.replace(")]}'", "", 1)
+    chunk_iter = strip_xssi_prefix(response.iter_content(CHUNK_SIZE))
+    # pages are bounded by PAGE_SIZE, keep one only when caching it
+    json_data = [] if client.cache is not None else None
     try:
-        json_data = json.loads(response_text)
+        for change in iter_json_array(chunk_iter):
+            if json_data is not None:
+                json_data.append(change)
+            yield change
     except json.decoder.JSONDecodeError as e:
         error_message = "please enter a valid username"
         logger(e, error_message)
         sys.exit()
+    finally:
+        response.close()
+        metrics.record_request(
+            GERRIT_METHOD, time.perf_counter() - start_time,
+            response.raw.tell(), response.status_code)
+
+    if client.cache is not None:
+        permanent = (is_settled_query(formatted_query)
+                     and is_closed_change_list(json_data))
+        client.cache.set(GERRIT_METHOD, cache_params, json_data, permanent)
+
+
+def iter_gerrit_changes(url, formatted_query, page_size=PAGE_SIZE):
+    """
+    Yield changes matching query, following
+    _more_changes one page at a time
+    """
+    start = 0
+    while True:
+        page_query = '{}&n={}&S={}'.format(formatted_query, page_size, start)
+        page_count = 0
+        more_changes = False
+        for change in fetech_gerrit_data(url, page_query):
+            page_count += 1
+            more_changes = change.get('_more_changes', False)
+            yield change
+        if not page_count or not more_changes:
+            break
+        start += page_count
+
+
+def get_day_count(start_date, end_date):
+    """ Return number of days from start_date to end_date"""
+    return (datetime.strptime(end_date, '%Y-%m-%d')
+            - datetime.strptime(start_date, '%Y-%m-%d')).days
+
+
+def get_windows(start_date, end_date, shard_count):
+    """
+    Return up to shard_count (after, before) date pairs
+    splitting start_date to end_date into whole days
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    day_count = get_day_count(start_date, end_date)
+    shard_count = max(1, min(shard_count, day_count))
+    edge_list = [
+        (start + timedelta(day_count * index // shard_count)).strftime(
+            '%Y-%m-%d')
+        for index in range(shard_count + 1)
+    ]
+    return list(zip(edge_list, edge_list[1:]))
+
+
+def split_window(window, change_list):
+    """
+    Return windows covering the part of window older than
+    change_list, bisected so each can be fetched on its own
+    """
+    # changes come newest first, the last one bounds what is left
+    last_updated = datetime.strptime(
+        change_list[-1]['updated'][:10], '%Y-%m-%d') + timedelta(1)
+    before = min(last_updated.strftime('%Y-%m-%d'), window[1])
+    return get_windows(window[0], before, 2)
+
+
+def fetch_window(url, query_params, window, adaptive, page_size,
+                 query_options=''):
+    """
+    Return window, its changes and whether more changes are
+    left to fetch, dense windows of more than a day are only
+    fetched a page at a time when adaptive
+    """
+    window_query = format_query_params(
+        dict(query_params, after=window[0], before=window[1])) + query_options
+    if not adaptive or get_day_count(*window) < 2:
+        return (window,
+                list(iter_gerrit_changes(url, window_query, page_size)),
+                False)
+    page_query = '{}&n={}&S=0'.format(window_query, page_size)
+    change_list = list(fetech_gerrit_data(url, page_query))
+    more_changes = bool(change_list) and change_list[-1].get(
+        '_more_changes', False)
+    return window, change_list, more_changes
+
+
+def iter_sharded_changes(url, query_params, start_date, end_date,
+                         shard_count=SHARD_WORKERS, adaptive=False,
+                         page_size=PAGE_SIZE, query_options=''):
+    """
+    Yield changes matching query_params between start_date and
+    end_date, querying date windows concurrently and yielding
+    changes on the edge of two windows once
+    """
+    seen_id_set = set()
+    with ThreadPoolExecutor(SHARD_WORKERS) as executor:
+        pending = {
+            executor.submit(
+                fetch_window, url, query_params, window, adaptive, page_size,
+                query_options)
+            for window in get_windows(start_date, end_date, shard_count)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window, change_list, more_changes = future.result()
+                for change in change_list:
+                    if change['id'] not in seen_id_set:
+                        seen_id_set.add(change['id'])
+                        yield change
+                if more_changes:
+                    for sub_window in split_window(window, change_list):
+                        pending.add(executor.submit(
+                            fetch_window, url, query_params, sub_window,
+                            adaptive, page_size, query_options))
+
+
+def get_status_counts(change_iter):
+    """ Return count of merged, open and abandoned changes in one pass"""
+    count_dict = {
+        StatusType.MERGED: 0,
+        StatusType.OPEN: 0,
+        StatusType.ABANDONED: 0,
+    }
+    for change in change_iter:
+        status_type = CHANGE_STATUS.get(change['status'])
+        if status_type is not None:
+            count_dict[status_type] += 1
+
+    return count_dict
+
+
+def parse_timestamp(timestamp):
+    """ Return datetime of a Gerrit UTC timestamp, dropping nanoseconds"""
+    return datetime.strptime(timestamp[:19], '%Y-%m-%d %H:%M:%S')
+
+
+class ChangeStats:
+    """
+    Aggregate of a change stream kept in one pass, memory grows
+    with the number of projects, branches and days, not of changes
+    """
 
-    return json_data
+    def __init__(self):
+        self.status_counts = {
+            StatusType.MERGED: 0,
+            StatusType.OPEN: 0,
+            StatusType.ABANDONED: 0,
+        }
+        self.project_counts = {}
+        self.branch_counts = {}
+        self.insertions = 0
+        self.deletions = 0
+        self.merge_sketch = LogSketch()
+        # merged changes per local day number since 1970-01-01
+        self.merged_day_counts = {}
+
+    def add(self, change):
+        """ Count one change"""
+        status_type = CHANGE_STATUS.get(change['status'])
+        if status_type is None:
+            return
+        self.status_counts[status_type] += 1
+        project = change.get('project')
+        self.project_counts[project] = self.project_counts.get(project, 0) + 1
+        branch = (project, change.get('branch'))
+        self.branch_counts[branch] = self.branch_counts.get(branch, 0) + 1
+        self.insertions += change.get('insertions', 0)
+        self.deletions += change.get('deletions', 0)
+        if status_type == StatusType.MERGED and change.get('submitted'):
+            submitted = parse_timestamp(change['submitted'])
+            created = parse_timestamp(change['created'])
+            self.merge_sketch.add((submitted - created).total_seconds())
+            day = get_local_day(calendar.timegm(submitted.timetuple()))
+            self.merged_day_counts[day] = (
+                self.merged_day_counts.get(day, 0) + 1)
+
+    def merge(self, other):
+        """ Add counts of another aggregate, eg of another owner"""
+        for status_type, count in other.status_counts.items():
+            self.status_counts[status_type] += count
+        for project, count in other.project_counts.items():
+            self.project_counts[project] = (
+                self.project_counts.get(project, 0) + count)
+        for branch, count in other.branch_counts.items():
+            self.branch_counts[branch] = (
+                self.branch_counts.get(branch, 0) + count)
+        self.insertions += other.insertions
+        self.deletions += other.deletions
+        self.merge_sketch.merge(other.merge_sketch)
+        for day, count in other.merged_day_counts.items():
+            self.merged_day_counts[day] = (
+                self.merged_day_counts.get(day, 0) + count)
+
+    def get_report(self, top_count=TOP_COUNT):
+        """ Return json serializable summary of the aggregate"""
+        def top(count_dict):
+            return sorted(count_dict.items(), key=lambda item: -item[1])[
+                :top_count]
+
+        return {
+            'counts': dict(self.status_counts),
+            'insertions': self.insertions,
+            'deletions': self.deletions,
+            'projects': [
+                {'project': project, 'count': count}
+                for project, count in top(self.project_counts)
+            ],
+            'branches': [
+                {'project': project, 'branch': branch, 'count': count}
+                for (project, branch), count in top(self.branch_counts)
+            ],
+            'merge_hours': {
+                'p{}'.format(percentile): seconds_to_hours(
+                    self.merge_sketch.quantile(percentile / 100))
+                for percentile in PERCENTILES
+            },
+        }
+
+
+def seconds_to_hours(seconds):
+    """ Return seconds as hours rounded to a tenth, None stays None"""
+    if seconds is None:
+        return None
+    return round(seconds / 3600, 1)
+
+
+def get_change_stats(change_iter):
+    """ Return ChangeStats of changes in one pass"""
+    change_stats = ChangeStats()
+    for change in change_iter:
+        change_stats.add(change)
+    return change_stats
+
+
+def index_merged(owner_name, change_stats, start_date, end_date):
+    """
+    Record merged changes per day in the activity index, if the
+    query reached today, as every merge of owner since start_date
+    """
+    # changes merged since start_date were updated since, but may be
+    # updated again after an end_date in the past and so left out
+    if to_day(end_date) <= to_day(datetime.now()):
+        return
+    index = ActivityIndex()
+    index.set_day_counts(MERGED, owner_name, change_stats.merged_day_counts,
+                         start_date, end_date)
+    index.save()
+
+
+def print_report(report):
+    """ Print a change report"""
+    for status_type, count in report['counts'].items():
+        print('Number of patches {} : {}'.format(status_type.lower(), count))
+    print('Lines inserted : {}'.format(report['insertions']))
+    print('Lines deleted : {}'.format(report['deletions']))
+    for name, hours in report['merge_hours'].items():
+        print('Time to merge {} : {} hours'.format(name, hours))
+    print('Top projects :')
+    for project_dict in report['projects']:
+        print('  {project} : {count}'.format(**project_dict))
+    print('Top branches :')
+    for branch_dict in report['branches']:
+        print('  {project} {branch} : {count}'.format(**branch_dict))
+
+
+def sync_owner_changes(change_store, url, owner_name, shard_count=0,
+                       adaptive=False, full_sync=False,
+                       reconcile_days=RECONCILE_DAYS):
+    """
+    Return count of merged, open and abandoned changes of owner,
+    fetching only changes updated since the last sync unless it
+    is the first, full_sync is set or reconcile_days have passed
+    """
+    last_updated, last_full_sync = change_store.get_watermark(owner_name)
+    sync_time = int(time.time())
+    full_sync = (full_sync or last_updated is None
+                 or sync_time - last_full_sync
+                 >= reconcile_days * SECONDS_PER_DAY)
+    if full_sync:
+        start_date = GERRIT_START_DATE
+        query_params = clean_input(owner_name, None)
+    else:
+        # after: takes whole days, start a day early so no time zone
+        # leaves changes out, they are merged by id
+        start_date = (parse_timestamp(last_updated)
+                      - timedelta(1)).strftime('%Y-%m-%d')
+        query_params = clean_input(owner_name, None, start_date)
+    if shard_count:
+        end_date = (datetime.now() + timedelta(1)).strftime('%Y-%m-%d')
+        change_iter = iter_sharded_changes(
+            url, query_params, start_date, end_date, shard_count, adaptive)
+    else:
+        change_iter = iter_gerrit_changes(
+            url, format_query_params(query_params))
+    change_list = [
+        (change['id'], change['status'], change['updated'])
+        for change in change_iter
+    ]
+    if change_list:
+        newest_updated = max(updated for _, _, updated in change_list)
+        if full_sync or newest_updated > last_updated:
+            last_updated = newest_updated
+    change_store.add_changes(
+        owner_name, change_list, last_updated,
+        sync_time if full_sync else last_full_sync, replace=full_sync)
+
+    count_dict = {
+        StatusType.MERGED: 0,
+        StatusType.OPEN: 0,
+        StatusType.ABANDONED: 0,
+    }
+    for status, count in change_store.get_status_counts(owner_name).items():
+        status_type = CHANGE_STATUS.get(status)
+        if status_type is not None:
+            count_dict[status_type] += count
+    return count_dict
+
+
+def format_owner_query(owner_list, query_params):
+    """ Return a query matching changes of any owner in owner_list"""
+    owner_clause = '({})'.format('+OR+'.join(
+        'owner:{}'.format(owner_name) for owner_name in owner_list))
+    other_params = {
+        q_key: q_value for q_key, q_value in query_params.items()
+        if q_key != 'owner'
+    }
+    if not other_params:
+        return owner_clause
+    return owner_clause + '+' + format_query_params(other_params)
+
+
+def chunk_owners(owner_list, query_params, max_length=MAX_QUERY_LENGTH):
+    """
+    Return owner_list split into chunks whose batch
+    query stays within max_length characters
+    """
+    owner_chunk_list = []
+    owner_chunk = []
+    for owner_name in owner_list:
+        if owner_chunk and len(format_owner_query(
+                owner_chunk + [owner_name], query_params)) > max_length:
+            owner_chunk_list.append(owner_chunk)
+            owner_chunk = []
+        owner_chunk.append(owner_name)
+    if owner_chunk:
+        owner_chunk_list.append(owner_chunk)
+    return owner_chunk_list
+
+
+def match_owner(change, owner_key_dict):
+    """
+    Return the owner a change belongs to, by email, username or
+    account id of its detailed owner, owner_key_dict mapping
+    casefolded owners to owners as given
+    """
+    owner_dict = change.get('owner', {})
+    for key in ('email', 'username', '_account_id', 'name'):
+        owner_name = owner_key_dict.get(str(owner_dict.get(key)).casefold())
+        if owner_name is not None:
+            return owner_name
+    return None
+
+
+def count_owner_chunk(url, owner_chunk, query_params):
+    """
+    Return dictionary mapping each owner of owner_chunk to counts of
+    its changes by status and number of changes matching no owner
+    """
+    # Gerrit matches owners regardless of case
+    owner_key_dict = {
+        owner_name.casefold(): owner_name for owner_name in owner_chunk
+    }
+    count_dict_dict = {
+        owner_name: {
+            StatusType.MERGED: 0,
+            StatusType.OPEN: 0,
+            StatusType.ABANDONED: 0,
+        }
+        for owner_name in owner_chunk
+    }
+    unmatched_count = 0
+    formatted_query = format_owner_query(
+        owner_chunk, query_params) + get_query_options(('status', 'owner'))
+    for change in iter_gerrit_changes(url, formatted_query):
+        owner_name = match_owner(change, owner_key_dict)
+        status_type = CHANGE_STATUS.get(change['status'])
+        if owner_name is None:
+            unmatched_count += 1
+        elif status_type is not None:
+            count_dict_dict[owner_name][status_type] += 1
+    return count_dict_dict, unmatched_count
+
+
+def get_owner_status_counts(url, owner_list, query_params,
+                            max_length=MAX_QUERY_LENGTH):
+    """
+    Return dictionary mapping each owner to counts of changes by
+    status, querying chunks of owners at once and concurrently
+    """
+    owner_count_dict = {}
+    unmatched_count = 0
+    owner_chunk_list = chunk_owners(owner_list, query_params, max_length)
+    with ThreadPoolExecutor(SHARD_WORKERS) as executor:
+        for count_dict_dict, chunk_unmatched_count in executor.map(
+                lambda owner_chunk: count_owner_chunk(
+                    url, owner_chunk, query_params),
+                owner_chunk_list):
+            owner_count_dict.update(count_dict_dict)
+            unmatched_count += chunk_unmatched_count
+    if unmatched_count:
+        # owners given by full name or an email other than the
+        # preferred one can't be told apart in the results
+        logger(None, '{} changes matched no owner, give owners by email '
+               'or username'.format(unmatched_count))
+    return owner_count_dict
 
 
 def get_count(json_data, status_type):
     """Return count of status type in json data"""
-    count_dict = Counter(data['status'] for data in json_data)
+    count_dict = get_status_counts(json_data)
     return count_dict[status_type]
 
 
 if __name__ == '__main__':
-    owner_name = input("enter username (eg:pmiazga@wikimedia.org) > ")
-    status_type = StatusType.MERGED
-    url = 'http://gerrit.wikimedia.org/r/changes/?q='
+    parser = argparse.ArgumentParser(
+        description='Count patches of a Gerrit owner by status')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='split the timeframe into this many date '
+                        'windows fetched concurrently')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='with --shards, split windows with more than '
+                        'a page of changes again')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--report', action='store_true',
+                            help='also report time to merge percentiles, '
+                            'lines changed and top projects and branches, '
+                            'and index merged changes per day')
+    mode_group.add_argument('--owners', metavar='FILE',
+                            help='count patches of every owner listed in '
+                            'FILE, one per line, in batched queries')
+    mode_group.add_argument('--incremental', action='store_true',
+                            help='keep counts of the whole history in the '
+                            'local store and only fetch changes updated '
+                            'since the last run')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='with --incremental, refetch the whole history '
+                        'now')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help='write request and phase metrics as json')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='write metrics in Prometheus text format')
+    args = parser.parse_args()
+    if args.reconcile and not args.incremental:
+        parser.error('--reconcile needs --incremental')
+    if args.owners and args.shards:
+        parser.error('--owners queries are not sharded')
+    if args.owners:
+        with open(args.owners) as owner_file:
+            owner_list = [line.strip() for line in owner_file
+                          if line.strip()]
+        owner_name = None
+    else:
+        owner_name = input("enter username (eg:pmiazga@wikimedia.org) > ")
+    url = client.GERRIT_URL
+    client.cache = ResponseCache()
 
     timeframe = input("search within a timeframe (press y or N)> ")
+    if args.incremental and (timeframe == 'y' or timeframe == 'Y'):
+        print("incremental counts cover the whole history, enter N")
+        sys.exit()
     if timeframe == 'y' or timeframe == 'Y':
         print("enter date in yyyy-mm-dd format, eg: 2018-01-15")
         start_date = input("enter starting date > ")
         end_date = input("enter ending date > ")
-        query_params = clean_input(owner_name, status_type, start_date, end_date)
+        query_params = clean_input(owner_name, None, start_date, end_date)
         print("fetching data from {} to {} ...".format(start_date, end_date))
     elif timeframe == 'n' or timeframe == 'N':
         print("fetching data from start of time to end of time...")
-        query_params = clean_input(owner_name, status_type)
+        query_params = clean_input(owner_name, None)
+        start_date = GERRIT_START_DATE
+        end_date = (datetime.now() + timedelta(1)).strftime('%Y-%m-%d')
     else:
         print("Invalid Input enter y or N")
         sys.exit()
 
-    formatted_query = format_query_params(query_params)
-    json_data = fetech_gerrit_data(url, formatted_query)
-    count = get_count(json_data, status_type)
-    print('Number of patches {} : {}'.format(status_type.lower(), count))
\ No newline at end of file
+    query_options = get_query_options(
+        REPORT_METRICS if args.report else ('status',))
+    if args.owners:
+        with metrics.phase('fetch'):
+            owner_count_dict = get_owner_status_counts(
+                url, owner_list, query_params)
+    elif args.incremental:
+        with metrics.phase('fetch'):
+            count_dict = sync_owner_changes(
+                ChangeStore(), url, owner_name, args.shards, args.adaptive,
+                args.reconcile)
+    elif args.shards:
+        change_iter = iter_sharded_changes(
+            url, query_params, start_date, end_date, args.shards,
+            args.adaptive, query_options=query_options)
+    else:
+        formatted_query = format_query_params(query_params) + query_options
+        change_iter = iter_gerrit_changes(url, formatted_query)
+    with metrics.phase('aggregate'):
+        if args.report:
+            change_stats = get_change_stats(change_iter)
+            report = change_stats.get_report()
+        elif not (args.incremental or args.owners):
+            count_dict = get_status_counts(change_iter)
+    if args.owners:
+        for owner_name in owner_list:
+            print(owner_name)
+            for status_type, count in owner_count_dict[owner_name].items():
+                print('  Number of patches {} : {}'.format(
+                    status_type.lower(), count))
+    elif args.report:
+        print_report(report)
+        index_merged(owner_name, change_stats, start_date, end_date)
+    else:
+        for status_type, count in count_dict.items():
+            print('Number of patches {} : {}'.format(
+                status_type.lower(), count))
+    metrics.write(args.metrics_json, args.metrics_prom)
\ No newline at end of file
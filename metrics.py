@@ -0,0 +1,143 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+METRIC_PREFIX = 'pygerrit'
+
+
+class Metrics:
+    """
+    Registry of per-method request statistics
+    and per-phase timers of a run
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.method_dict = {}
+        self.phase_dict = {}
+
+    def get_method(self, method_name):
+        """ Return statistics dictionary of a method, creating it"""
+        if method_name not in self.method_dict:
+            self.method_dict[method_name] = {
+                'requests': 0,
+                'seconds': 0.0,
+                'max_seconds': 0.0,
+                'bytes': 0,
+                'retries': 0,
+                'cache_hits': 0,
+                'status_codes': {},
+            }
+        return self.method_dict[method_name]
+
+    def record_request(self, method_name, elapsed, size=0, status=None):
+        """ Record one request sent for method_name"""
+        with self.lock:
+            method_stats = self.get_method(method_name)
+            method_stats['requests'] += 1
+            method_stats['seconds'] += elapsed
+            method_stats['max_seconds'] = max(
+                method_stats['max_seconds'], elapsed)
+            method_stats['bytes'] += size
+            if status is not None:
+                status_codes = method_stats['status_codes']
+                status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+    def get_request_count(self):
+        """ Return requests sent for all methods"""
+        with self.lock:
+            return sum(method_stats['requests']
+                       for method_stats in self.method_dict.values())
+
+    def record_retry(self, method_name):
+        """ Record a request of method_name being retried"""
+        with self.lock:
+            self.get_method(method_name)['retries'] += 1
+
+    def record_cache_hit(self, method_name, count=1):
+        """ Record responses served from cache for method_name"""
+        with self.lock:
+            self.get_method(method_name)['cache_hits'] += count
+
+    def add_phase_time(self, phase_name, elapsed):
+        """ Add elapsed seconds to a phase timer"""
+        with self.lock:
+            phase_stats = self.phase_dict.setdefault(
+                phase_name, {'seconds': 0.0, 'count': 0})
+            phase_stats['seconds'] += elapsed
+            phase_stats['count'] += 1
+
+    @contextmanager
+    def phase(self, phase_name):
+        """ Time the enclosed block as phase_name"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(phase_name, time.perf_counter() - start_time)
+
+    def summary(self):
+        """ Return a copy of all recorded statistics"""
+        with self.lock:
+            return json.loads(json.dumps({
+                'methods': self.method_dict,
+                'phases': self.phase_dict,
+            }))
+
+    def export_json(self):
+        """ Return recorded statistics as a json document"""
+        return json.dumps(self.summary(), indent=2, sort_keys=True)
+
+    def export_prometheus(self):
+        """ Return recorded statistics in Prometheus text exposition"""
+        summary = self.summary()
+        line_list = []
+
+        def add_metric(name, metric_type, help_text, sample_list):
+            metric_name = '{}_{}'.format(METRIC_PREFIX, name)
+            line_list.append('# HELP {} {}'.format(metric_name, help_text))
+            line_list.append('# TYPE {} {}'.format(metric_name, metric_type))
+            for label_dict, value in sample_list:
+                labels = ','.join(
+                    '{}="{}"'.format(key, label_value)
+                    for key, label_value in label_dict.items()
+                )
+                line_list.append('{}{{{}}} {}'.format(metric_name, labels, value))
+
+        method_items = sorted(summary['methods'].items())
+        for key, metric_type, help_text in (
+                ('requests', 'counter', 'Requests sent per api method'),
+                ('seconds', 'counter', 'Seconds spent in requests'),
+                ('max_seconds', 'gauge', 'Slowest request in seconds'),
+                ('bytes', 'counter', 'Response bytes received'),
+                ('retries', 'counter', 'Requests retried'),
+                ('cache_hits', 'counter', 'Responses served from cache')):
+            name = key if metric_type == 'gauge' else key + '_total'
+            add_metric('method_' + name, metric_type, help_text, [
+                ({'method': method_name}, method_stats[key])
+                for method_name, method_stats in method_items
+            ])
+        add_metric('responses_total', 'counter', 'Responses per status code', [
+            ({'method': method_name, 'code': code}, count)
+            for method_name, method_stats in method_items
+            for code, count in sorted(method_stats['status_codes'].items())
+        ])
+        add_metric('phase_seconds_total', 'counter', 'Seconds spent per phase', [
+            ({'phase': phase_name}, phase_stats['seconds'])
+            for phase_name, phase_stats in sorted(summary['phases'].items())
+        ])
+        return '\n'.join(line_list) + '\n'
+
+    def write(self, json_path=None, prometheus_path=None):
+        """ Write recorded statistics to the given files"""
+        if json_path:
+            with open(json_path, 'w') as json_file:
+                json_file.write(self.export_json())
+        if prometheus_path:
+            with open(prometheus_path, 'w') as prometheus_file:
+                prometheus_file.write(self.export_prometheus())
+
+
+metrics = Metrics()
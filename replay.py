@@ -0,0 +1,214 @@
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+import subprocess
+import requests
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import client
+
+
+SPEEDS = ('recorded', 'fast')
+PHABRICATOR_PREFIX = '/phabricator/'
+GERRIT_PREFIX = '/gerrit/'
+# response headers worth replaying, the rest is set by the server
+KEPT_HEADERS = ('Content-Type', 'Retry-After')
+
+
+def get_key(path):
+    """
+    Return a request path with sorted query parameters
+    and without api.token, identifying a recorded response
+    """
+    split_path = urlsplit(path)
+    param_list = sorted(
+        (key, value) for key, value in parse_qsl(
+            split_path.query, keep_blank_values=True)
+        if key != 'api.token'
+    )
+    return split_path.path + '?' + urlencode(param_list)
+
+
+def write_entry(archive_file, entry, body):
+    """ Append a json header line followed by the raw response body"""
+    header = dict(entry, size=len(body))
+    archive_file.write(json.dumps(header).encode() + b'\n')
+    archive_file.write(body)
+
+
+def iter_entries(archive_path):
+    """ Yield (header, body) of each recorded response in order"""
+    with gzip.open(archive_path, 'rb') as archive_file:
+        while True:
+            line = archive_file.readline()
+            if not line:
+                return
+            header = json.loads(line)
+            yield header, archive_file.read(header['size'])
+
+
+class TrafficHandler(BaseHTTPRequestHandler):
+    """ Answer requests with what the server records or replays"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        status, header_dict, body = self.server.respond(self.path)
+        self.send_response(status)
+        for name, value in header_dict.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RecordServer(ThreadingHTTPServer):
+    """
+    Proxy forwarding Phabricator and Gerrit requests upstream
+    and recording each response and its latency to an archive
+    """
+    daemon_threads = True
+
+    def __init__(self, address, archive_path, phabricator_url, gerrit_url):
+        super().__init__(address, TrafficHandler)
+        self.upstream_dict = {
+            PHABRICATOR_PREFIX: phabricator_url,
+            GERRIT_PREFIX: gerrit_url,
+        }
+        self.session = client.open_session()
+        self.lock = threading.Lock()
+        self.archive_file = gzip.open(archive_path, 'wb')
+        self.request_count = 0
+
+    def respond(self, path):
+        """ Return status, headers and body of the upstream response"""
+        for prefix, upstream_url in self.upstream_dict.items():
+            if path.startswith(prefix):
+                url = upstream_url + path[len(prefix):]
+                break
+        else:
+            return 404, {}, b'unknown upstream'
+        start_time = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=client.REQUEST_TIMEOUT)
+        except requests.RequestException:
+            return 502, {}, b'upstream request failed'
+        elapsed = time.perf_counter() - start_time
+        header_dict = {
+            name: response.headers[name] for name in KEPT_HEADERS
+            if name in response.headers
+        }
+        entry = {
+            'key': get_key(path),
+            'status': response.status_code,
+            'headers': header_dict,
+            'elapsed': round(elapsed, 6),
+        }
+        with self.lock:
+            write_entry(self.archive_file, entry, response.content)
+            self.request_count += 1
+        return response.status_code, header_dict, response.content
+
+    def close(self):
+        """ Finish the archive"""
+        with self.lock:
+            self.archive_file.close()
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Serve recorded responses, each key's in recorded order, at
+    recorded latency or as fast as possible, repeating the last
+    response of a key once its recordings run out
+    """
+    daemon_threads = True
+
+    def __init__(self, address, archive_path, speed='fast'):
+        super().__init__(address, TrafficHandler)
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.entry_dict = {}
+        for header, body in iter_entries(archive_path):
+            self.entry_dict.setdefault(header['key'], deque()).append(
+                (header, body))
+        self.request_count = 0
+        self.miss_count = 0
+
+    def respond(self, path):
+        """ Return status, headers and body recorded for path"""
+        with self.lock:
+            self.request_count += 1
+            entry_queue = self.entry_dict.get(get_key(path))
+            if not entry_queue:
+                self.miss_count += 1
+                return 404, {}, b'not recorded'
+            if len(entry_queue) > 1:
+                header, body = entry_queue.popleft()
+            else:
+                header, body = entry_queue[0]
+        if self.speed == 'recorded':
+            time.sleep(header['elapsed'])
+        return header['status'], header['headers'], body
+
+    def close(self):
+        """ Report requests the archive had no response for"""
+        if self.miss_count:
+            client.logger(None, '{} of {} requests were not recorded'.format(
+                self.miss_count, self.request_count))
+
+
+def get_environment(server):
+    """ Return environment pointing the scripts at server"""
+    base_url = 'http://{}:{}'.format(*server.server_address[:2])
+    return dict(
+        os.environ,
+        PHABRICATOR_URL=base_url + PHABRICATOR_PREFIX,
+        GERRIT_URL=base_url + GERRIT_PREFIX + '?q=',
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Record api traffic of a command, or replay it offline')
+    parser.add_argument('mode', choices=('record', 'replay'))
+    parser.add_argument('archive', help='gzip archive of recorded traffic')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='command to run against the server, serve '
+                        'until interrupted if none')
+    parser.add_argument('--speed', choices=SPEEDS, default='fast',
+                        help='replay at recorded latency or as fast as '
+                        'possible')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+    address = ('127.0.0.1', args.port)
+    if args.mode == 'record':
+        server = RecordServer(address, args.archive, client.BASE_URL,
+                              client.GERRIT_URL.split('?')[0])
+    else:
+        server = ReplayServer(address, args.archive, args.speed)
+    environment = get_environment(server)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return_code = 0
+    try:
+        if args.command:
+            return_code = subprocess.run(
+                args.command, env=environment).returncode
+        else:
+            print('PHABRICATOR_URL={} GERRIT_URL={}'.format(
+                environment['PHABRICATOR_URL'], environment['GERRIT_URL']))
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.close()
+        print('{} requests {}ed'.format(server.request_count, args.mode),
+              file=sys.stderr)
+    sys.exit(return_code)
@@ -0,0 +1,70 @@
+import time
+import random
+import requests
+from email.utils import parsedate_to_datetime
+from metrics import metrics
+
+
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_retry_after(header_value):
+    """
+    Return seconds to wait from a Retry-After header,
+    given as seconds or an HTTP date, None if absent
+    """
+    if not header_value:
+        return None
+    try:
+        return max(float(header_value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(header_value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_date.timestamp() - time.time(), 0)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Return seconds to sleep before retry number attempt,
+    honoring Retry-After over full-jitter exponential backoff
+    """
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def is_retryable_status(status_code):
+    """ Return True if a response status is worth retrying"""
+    return status_code in RETRY_STATUSES
+
+
+class RetryError(Exception):
+    """ Raised when a request still fails after all retries"""
+
+
+def send_with_retry(send_request, method_name, max_retries=MAX_RETRIES):
+    """
+    Return response of send_request, retrying connection
+    errors and retryable statuses with backoff
+    """
+    for attempt in range(max_retries + 1):
+        retry_after = None
+        try:
+            response = send_request()
+        except requests.exceptions.RequestException as e:
+            error = e
+        else:
+            if not is_retryable_status(response.status_code):
+                return response
+            error = 'HTTP {}'.format(response.status_code)
+            retry_after = get_retry_after(response.headers.get('Retry-After'))
+        if attempt == max_retries:
+            raise RetryError(error)
+        metrics.record_retry(method_name)
+        time.sleep(backoff_delay(attempt, retry_after))
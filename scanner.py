@@ -0,0 +1,82 @@
+import json
+from cache import is_closed_task
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """ Return decoded json of bytes or text, with orjson if installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(json_data):
+    """ Return compact json text of json data"""
+    if orjson is not None:
+        return orjson.dumps(json_data).decode()
+    return json.dumps(json_data, separators=(',', ':'))
+
+
+def find_subs_date(transaction_list, subscriber_phid, min_transaction_id=0):
+    """
+    Return date of the transaction subscribing subscriber,
+    newer than min_transaction_id if given, or None
+    """
+    for transaction in transaction_list:
+        if (min_transaction_id
+                and int(transaction['transactionID']) <= min_transaction_id):
+            continue
+        if transaction['transactionType'] == 'core:subscribers':
+            cond_1 = subscriber_phid not in transaction['oldValue']
+            cond_2 = subscriber_phid in transaction['newValue']
+            if cond_1 and cond_2:
+                return transaction['dateCreated']
+    return None
+
+
+def collect_subs_dates(transaction_dict, task_id_list, subscriber_phid):
+    """ Return dates subscriber subscribed to each of the tasks"""
+    subs_date_list = []
+    for task_id in task_id_list:
+        subs_date = find_subs_date(
+            transaction_dict.get(str(task_id), []), subscriber_phid)
+        if subs_date is not None:
+            subs_date_list.append(subs_date)
+    return subs_date_list
+
+
+def scan_responses(cached_body_list, fetched_body_list, subscriber_phid,
+                   keep_text=False):
+    """
+    Decode maniphest.gettasktransactions response bodies and return
+    (task id, subscription epoch) events, id's of tasks present and,
+    if keep_text, the transactions of each task of a fetched body as
+    json text for the cache with whether the task is closed, run in
+    a worker process
+    """
+    subs_event_list = []
+    task_id_list = []
+    text_dict = {}
+    tagged_body_list = [(body, False) for body in cached_body_list]
+    tagged_body_list.extend(
+        (body, keep_text) for body in fetched_body_list)
+    for body, keep_body_text in tagged_body_list:
+        try:
+            json_data = loads(body)
+        except ValueError:
+            continue
+        result_dict = json_data.get('result') or {}
+        for task_id, transaction_list in result_dict.items():
+            task_id_list.append(task_id)
+            subs_date = find_subs_date(transaction_list, subscriber_phid)
+            if subs_date is not None:
+                subs_event_list.append((int(task_id), int(subs_date)))
+            if keep_body_text:
+                text_dict[task_id] = (
+                    dumps({'result': {task_id: transaction_list}}),
+                    is_closed_task(transaction_list))
+    return subs_event_list, task_id_list, text_dict
@@ -0,0 +1,119 @@
+import time
+import asyncio
+import threading
+from urllib.parse import urlparse
+
+
+# Requests per second allowed per host, and burst size
+HOST_RATE = 50
+HOST_BURST = 50
+# Smoothed latency above this multiple of the best seen counts as rising
+LATENCY_TOLERANCE = 2.0
+LATENCY_SMOOTHING = 0.2
+DECREASE_FACTOR = 0.5
+
+
+class TokenBucket:
+    """ Client-side rate limit of rate requests per second"""
+
+    def __init__(self, rate=HOST_RATE, burst=HOST_BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token and return seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """ Block until a request may be sent"""
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """ Wait until a request may be sent"""
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+bucket_dict = {}
+bucket_lock = threading.Lock()
+
+
+def get_bucket(url):
+    """ Return the shared token bucket of url's host"""
+    host = urlparse(url).netloc
+    with bucket_lock:
+        if host not in bucket_dict:
+            bucket_dict[host] = TokenBucket()
+        return bucket_dict[host]
+
+
+class AIMDController:
+    """
+    Concurrency limit that grows additively while requests
+    stay fast and healthy and halves on errors or rising latency
+    """
+
+    def __init__(self, initial_limit, min_limit=1, max_limit=64):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.min_latency = None
+        self.smoothed_latency = None
+        self.last_decrease = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        """ Wait for a free slot under the current limit"""
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, ok):
+        """ Free a slot and adjust the limit from its outcome"""
+        async with self.condition:
+            self.in_flight -= 1
+            if ok:
+                self.observe(latency)
+            else:
+                self.decrease(latency)
+            self.condition.notify_all()
+
+    def observe(self, latency):
+        """ Grow the limit unless latency is rising"""
+        if self.min_latency is None:
+            self.min_latency = self.smoothed_latency = latency
+        self.min_latency = min(self.min_latency, latency)
+        self.smoothed_latency += LATENCY_SMOOTHING * (
+            latency - self.smoothed_latency)
+        if self.smoothed_latency > LATENCY_TOLERANCE * self.min_latency:
+            self.decrease(latency)
+        else:
+            # roughly one extra slot per round trip of the whole window
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def decrease(self, latency):
+        """ Halve the limit, at most once per round trip"""
+        now = time.monotonic()
+        if now - self.last_decrease < (latency or 0):
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        if self.smoothed_latency is not None:
+            # start judging latency afresh at the lower limit
+            self.smoothed_latency = self.min_latency
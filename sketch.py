@@ -0,0 +1,61 @@
+import math
+
+
+# Quantiles are returned within this relative error of the true value
+RELATIVE_ACCURACY = 0.01
+
+
+class LogSketch:
+    """
+    Mergeable quantile sketch counting values in logarithmic
+    buckets, memory grows with the range of values, not their count
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bucket_dict = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        """ Count one value, values below 1 share a single bucket"""
+        self.count += 1
+        self.total += value
+        if value < 1:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bucket_dict[index] = self.bucket_dict.get(index, 0) + 1
+
+    def merge(self, other):
+        """ Add counts of another sketch of the same accuracy"""
+        if other.gamma != self.gamma:
+            raise ValueError('cannot merge sketches of different accuracy')
+        for index, count in other.bucket_dict.items():
+            self.bucket_dict[index] = self.bucket_dict.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, fraction):
+        """ Return estimated value at fraction of values, None if empty"""
+        if not self.count:
+            return None
+        rank = fraction * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.bucket_dict):
+            seen += self.bucket_dict[index]
+            if rank < seen:
+                # midpoint of the bucket in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bucket_dict) / (self.gamma + 1)
+
+    def mean(self):
+        """ Return mean of counted values, None if empty"""
+        if not self.count:
+            return None
+        return self.total / self.count
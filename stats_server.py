@@ -0,0 +1,319 @@
+import json
+import asyncio
+import argparse
+import datetime
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import client
+import issue_fetcher
+import task_statistics
+from activity_index import ActivityIndex
+from cache import ResponseCache
+from client import (CONCURRENCY, MAX_CONCURRENCY, REQUEST_TIMEOUT,
+                    FetchError, get_user_phids, get_window, logger,
+                    open_async_session)
+from histogram import GRANULARITIES, get_month_week_counts
+from metrics import metrics
+from scheduler import AIMDController
+
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+
+class RequestError(Exception):
+    """ Raised for a query the service can't answer"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SingleFlight:
+    """
+    Run one computation per key at a time, callers asking
+    for a key already in flight wait for its result
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def do(self, key, function):
+        """ Return result of function, shared by concurrent callers of key"""
+        with self.lock:
+            future = self.pending.get(key)
+            leader = future is None
+            if leader:
+                future = self.pending[key] = Future()
+        if leader:
+            try:
+                future.set_result(function())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.lock:
+                    del self.pending[key]
+        return future.result()
+
+
+class AsyncRunner:
+    """
+    Event loop on a background thread keeping one aiohttp
+    session and concurrency limit open across queries
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.session, self.controller = self.run(
+            self.open(concurrency, timeout))
+
+    async def open(self, concurrency, timeout):
+        """ Return session and controller, created on the loop"""
+        controller = AIMDController(concurrency, max_limit=MAX_CONCURRENCY)
+        return open_async_session(timeout), controller
+
+    def run(self, coroutine):
+        """ Return result of coroutine run on the background loop"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        """ Close the session and stop the loop"""
+        self.run(self.session.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class StatsService:
+    """
+    Gerrit change counts and Phabricator subscriptions computed
+    over warm connection pools, PhID and response caches, ranges
+    in the activity index answered without fetching
+    """
+
+    def __init__(self):
+        self.runner = AsyncRunner()
+        self.phid_lock = threading.Lock()
+        self.phid_dict = {}
+        self.index_lock = threading.Lock()
+        self.index = ActivityIndex()
+
+    def get_phid(self, username):
+        """ Return user's PhID, resolving each user once"""
+        with self.phid_lock:
+            phid = self.phid_dict.get(username)
+        if phid is None:
+            phid = get_user_phids([username]).get(username)
+            if phid is None:
+                raise RequestError(404, 'unknown user {}'.format(username))
+            with self.phid_lock:
+                self.phid_dict[username] = phid
+        return phid
+
+    def get_gerrit_counts(self, owner_name, start_date=None, end_date=None,
+                          shards=0, report=False):
+        """
+        Return merged, open and abandoned change counts of owner,
+        with sizes, merge times and top projects if report
+        """
+        query_params = issue_fetcher.clean_input(
+            owner_name, None, start_date, end_date)
+        query_options = issue_fetcher.get_query_options(
+            issue_fetcher.REPORT_METRICS if report else ('status',))
+        if shards:
+            end_date = end_date or (
+                datetime.date.today() + datetime.timedelta(1)).isoformat()
+            change_iter = issue_fetcher.iter_sharded_changes(
+                client.GERRIT_URL, query_params,
+                start_date or issue_fetcher.GERRIT_START_DATE, end_date,
+                shards, query_options=query_options)
+        else:
+            change_iter = issue_fetcher.iter_gerrit_changes(
+                client.GERRIT_URL,
+                issue_fetcher.format_query_params(query_params)
+                + query_options)
+        if report:
+            return dict(
+                issue_fetcher.get_change_stats(change_iter).get_report(),
+                owner=owner_name)
+        return {
+            'owner': owner_name,
+            'counts': issue_fetcher.get_status_counts(change_iter),
+        }
+
+    def get_subscriptions(self, username, start_date, end_date,
+                          granularity=None):
+        """
+        Return user's subscription counts per week of the month of
+        start_date, or per granularity period from start to end date
+        """
+        with self.index_lock:
+            subs_count_dict = task_statistics.get_indexed_subs(
+                self.index, username, start_date, end_date, granularity)
+        if subs_count_dict is not None:
+            return {
+                'username': username,
+                'counts': subs_count_dict,
+                'missing_tasks': [],
+            }
+        phid = self.get_phid(username)
+        window_start, window_end = get_window(start_date, end_date)
+        subs_date_list, missing_id_list = self.runner.run(
+            task_statistics.subs_pipeline(
+                self.runner.session, self.runner.controller, username, phid,
+                window_start, window_end))
+        if granularity is None:
+            subs_count_dict = get_month_week_counts(
+                subs_date_list, start_date)
+        else:
+            subs_count_dict = task_statistics.get_subs_per_period(
+                {username: subs_date_list}, start_date, end_date,
+                granularity)[username]
+        if not missing_id_list:
+            with self.index_lock:
+                task_statistics.index_subs(
+                    self.index, {username: subs_date_list}, start_date,
+                    end_date)
+        return {
+            'username': username,
+            'counts': subs_count_dict,
+            'missing_tasks': missing_id_list,
+        }
+
+    def close(self):
+        """ Release connections"""
+        self.runner.close()
+
+
+def get_param(query_dict, name, required=False):
+    """ Return a query parameter, None if absent and not required"""
+    value = query_dict.get(name)
+    if required and not value:
+        raise RequestError(400, 'missing parameter {}'.format(name))
+    return value
+
+
+def get_date_param(query_dict, name, date_format='%Y-%m-%d'):
+    """ Return a query parameter parsed as a date, None if absent"""
+    value = get_param(query_dict, name)
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, date_format)
+    except ValueError:
+        raise RequestError(400, 'parameter {} is not a {} date'.format(
+            name, date_format.replace('%', '')))
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    """ Serve statistics as json"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed_url = urlparse(self.path)
+        query_dict = {
+            key: value[0] for key, value in parse_qs(parsed_url.query).items()
+        }
+        content_type = 'application/json'
+        try:
+            if parsed_url.path == '/metrics':
+                content_type = 'text/plain; version=0.0.4'
+                status, body = 200, metrics.export_prometheus().encode()
+            else:
+                # identical queries in flight share one computation
+                key = (parsed_url.path, tuple(sorted(query_dict.items())))
+                status, body = 200, json.dumps(self.server.flight.do(
+                    key, lambda: self.route(parsed_url.path, query_dict)
+                )).encode()
+        except RequestError as e:
+            status, body = e.status, json.dumps({'error': e.message}).encode()
+        except (FetchError, SystemExit):
+            status = 502
+            body = json.dumps({'error': 'upstream request failed'}).encode()
+        except Exception as e:
+            # answer instead of dropping the connection, eg on a malformed
+            # change or transaction
+            logger(e, '{} failed: {!r}'.format(self.path, e))
+            status = 500
+            body = json.dumps({'error': 'internal error'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, path, query_dict):
+        """ Return json data answering a query"""
+        service = self.server.service
+        if path == '/health':
+            return {'status': 'ok'}
+        if path in ('/gerrit/counts', '/gerrit/report'):
+            start_date = get_date_param(query_dict, 'start')
+            end_date = get_date_param(query_dict, 'end')
+            try:
+                shards = int(get_param(query_dict, 'shards') or 0)
+            except ValueError:
+                raise RequestError(400, 'parameter shards is not a number')
+            return service.get_gerrit_counts(
+                get_param(query_dict, 'owner', required=True),
+                start_date and start_date.strftime('%Y-%m-%d'),
+                end_date and end_date.strftime('%Y-%m-%d'), shards,
+                path == '/gerrit/report')
+        if path == '/phabricator/subscriptions':
+            username = get_param(query_dict, 'username', required=True)
+            start_date = get_date_param(query_dict, 'start')
+            if start_date is None:
+                month_date = get_date_param(query_dict, 'month', '%Y-%m')
+                if month_date is None:
+                    raise RequestError(400, 'missing parameter month or start')
+                next_month = (month_date.replace(day=28)
+                              + datetime.timedelta(4)).replace(day=1)
+                return service.get_subscriptions(
+                    username, month_date,
+                    next_month - datetime.timedelta(1))
+            granularity = get_param(query_dict, 'granularity') or 'week'
+            if granularity not in GRANULARITIES:
+                raise RequestError(400, 'granularity is one of {}'.format(
+                    ', '.join(GRANULARITIES)))
+            end_date = (get_date_param(query_dict, 'end')
+                        or datetime.datetime.now())
+            return service.get_subscriptions(
+                username, start_date, end_date, granularity)
+        raise RequestError(404, 'unknown path {}'.format(path))
+
+
+class StatsServer(ThreadingHTTPServer):
+    """ Local json api over one shared StatsService"""
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, StatsHandler)
+        self.service = service
+        self.flight = SingleFlight()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve Gerrit and Phabricator statistics as json')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    client.cache = ResponseCache()
+    service = StatsService()
+    server = StatsServer((args.host, args.port), service)
+    print('serving on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
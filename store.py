@@ -0,0 +1,133 @@
+import sqlite3
+
+
+STORE_PATH = 'activity_store.sqlite'
+
+
+class SubscriptionStore:
+    """
+    SQLite backed store of subscription events
+    and per-user sync watermarks
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS watermark ('
+            ' username TEXT PRIMARY KEY, user_phid TEXT,'
+            ' last_sync INTEGER, last_transaction_id INTEGER)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS subscription ('
+            ' user_phid TEXT, task_id INTEGER, subs_date INTEGER,'
+            ' PRIMARY KEY (user_phid, task_id))'
+        )
+        self.connection.commit()
+
+    def get_watermark(self, username):
+        """
+        Return last sync time and last transaction id
+        seen for user, (None, 0) if never synced
+        """
+        row = self.connection.execute(
+            'SELECT last_sync, last_transaction_id FROM watermark'
+            ' WHERE username = ?', (username,)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        return row[0], row[1]
+
+    def add_subs_events(self, username, user_phid, subs_event_list,
+                        last_sync, last_transaction_id):
+        """
+        Merge (task id, subscription date) events and
+        move the user's watermark forward in one commit
+        """
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO subscription VALUES (?, ?, ?)',
+            [(user_phid, task_id, int(subs_date))
+             for task_id, subs_date in subs_event_list]
+        )
+        self.connection.execute(
+            'INSERT OR REPLACE INTO watermark VALUES (?, ?, ?, ?)',
+            (username, user_phid, last_sync, last_transaction_id)
+        )
+        self.connection.commit()
+
+    def get_subs_dates(self, user_phid):
+        """ Return all stored subscription dates of user"""
+        row_list = self.connection.execute(
+            'SELECT subs_date FROM subscription WHERE user_phid = ?',
+            (user_phid,)
+        ).fetchall()
+        return [row[0] for row in row_list]
+
+    def close(self):
+        """ Close the database connection"""
+        self.connection.close()
+
+
+class ChangeStore:
+    """
+    SQLite backed store of the status of each Gerrit change
+    of an owner and per-owner sync watermarks
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS change_watermark ('
+            ' owner TEXT PRIMARY KEY, last_updated TEXT,'
+            ' last_full_sync INTEGER)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS change ('
+            ' owner TEXT, change_id TEXT, status TEXT, updated TEXT,'
+            ' PRIMARY KEY (owner, change_id))'
+        )
+        self.connection.commit()
+
+    def get_watermark(self, owner_name):
+        """
+        Return newest update time of a change seen and time of
+        the last full sync of owner, (None, None) if never synced
+        """
+        row = self.connection.execute(
+            'SELECT last_updated, last_full_sync FROM change_watermark'
+            ' WHERE owner = ?', (owner_name,)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], row[1]
+
+    def add_changes(self, owner_name, change_list, last_updated,
+                    last_full_sync, replace=False):
+        """
+        Merge (change id, status, updated) rows, replacing all of
+        owner's rows if replace, and move the watermark in one commit
+        """
+        if replace:
+            self.connection.execute(
+                'DELETE FROM change WHERE owner = ?', (owner_name,))
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO change VALUES (?, ?, ?, ?)',
+            [(owner_name, change_id, status, updated)
+             for change_id, status, updated in change_list]
+        )
+        self.connection.execute(
+            'INSERT OR REPLACE INTO change_watermark VALUES (?, ?, ?)',
+            (owner_name, last_updated, last_full_sync)
+        )
+        self.connection.commit()
+
+    def get_status_counts(self, owner_name):
+        """ Return dictionary mapping Gerrit status to owner's changes"""
+        row_list = self.connection.execute(
+            'SELECT status, COUNT(*) FROM change WHERE owner = ?'
+            ' GROUP BY status', (owner_name,)
+        ).fetchall()
+        return dict(row_list)
+
+    def close(self):
+        """ Close the database connection"""
+        self.connection.close()
@@ -1,213 +1,717 @@
 import sys
+import time
+import asyncio
+import argparse
 import datetime
-import grequests
-import requests
-from math import ceil
-
+from concurrent.futures import ProcessPoolExecutor
+import client
+from activity_index import SUBSCRIPTIONS, ActivityIndex
+from cache import ResponseCache
+from client import (BATCH_SIZE, CONCURRENCY, MAX_CONCURRENCY,
+                    REQUEST_TIMEOUT, FetchError, chunk_list, fetch_bytes,
+                    fetch_json, fetch_method, get_clean_date, get_clean_day,
+                    get_ids_params, get_method_url, get_page_task_ids,
+                    get_search_params, get_user_phid,
+                    get_user_phids, get_user_subs_task, get_window,
+                    is_last_page, logger, open_async_session)
+from store import SubscriptionStore
+from scheduler import AIMDController
+from histogram import (GRANULARITIES, bin_user_epochs, get_bin_labels,
+                       get_month_week_counts, print_period_counts)
+from metrics import metrics
+from scanner import collect_subs_dates, find_subs_date, scan_responses
+
+
+REDRIVE_BATCH_SIZE = 10
+# batches of task id's waiting between search pages and fetch workers
+PIPELINE_QUEUE_SIZE = 32
+# transaction.search pages are per task, so smaller ones waste fewer bytes
+TRANSACTION_PAGE_SIZE = 100
+BACKENDS = ('transactions', 'search')
+backend = 'transactions'
+author_phid = None
+store = None
+# process pool decoding and scanning transactions, None scans in process
+scan_pool = None
+
+
+def get_url(task_id_list, batch_size=BATCH_SIZE):
+    """
+    Return list of urls, each fetching
+    transactions of a batch of tasks
+    """
+    method_name = 'maniphest.gettasktransactions'
+    return [get_method_url(method_name, get_ids_params(task_id_chunk))
+            for task_id_chunk in chunk_list(task_id_list, batch_size)]
 
-BASE_URL = 'https://phabricator.wikimedia.org/api/'
-API_KEY = 'YOUR API-KEY HERE'
 
+async def fetch_transaction_urls(session, controller, url_list):
+    """
+    Return dictionary mapping task id to its list of
+    transactions, merging responses as they complete,
+    tasks of failed requests are left out
+    """
+    transaction_dict = {}
+    pending = [fetch_json(session, controller, url) for url in url_list]
+    for future in asyncio.as_completed(pending):
+        json_data = await future
+        if json_data is not None and json_data.get('result'):
+            transaction_dict.update(json_data['result'])
 
-def logger(error_code, error_message):
-    """ Print error message"""
-    print('Error : {}'.format(error_message))
+    return transaction_dict
 
 
-def g_exception_handler(request, exception):
-    """ Handle exceptions for grequests"""
-    print('Error : Request Failed')
-    sys.exit()
+async def fetch_all(url_list, concurrency, timeout):
+    """ Return transactions for given urls over a new session"""
+    controller = AIMDController(concurrency, max_limit=MAX_CONCURRENCY)
+    async with open_async_session(timeout) as session:
+        return await fetch_transaction_urls(session, controller, url_list)
 
 
-def fetch_data(method_name, query_params):
+def get_json_response(url_list, concurrency=CONCURRENCY,
+                      timeout=REQUEST_TIMEOUT):
     """
-    Return json response for
-    given method name and parameters
+    Return transactions for given urls, starting with concurrency
+    requests in flight and adapting to server latency and errors
     """
-    url = BASE_URL + method_name
-    query_params['api.token'] = API_KEY
-    try:
-        response = requests.get(url, params=query_params)
-    except requests.exceptions.RequestException as e:
-        error_message = 'please enter a valid url'
-        logger(e, error_message)
-        sys.exit()
+    return asyncio.run(fetch_all(url_list, concurrency, timeout))
 
-    try:
-        json_data = response.json()
-    except json.decoder.JSONDecodeError as e:
-        error_message = "please enter a valid url"
-        logger(e, error_message)
-        sys.exit()
 
-    return json_data
+def get_missing_tasks(transaction_dict, task_id_list):
+    """ Return task id's whose transactions were not fetched"""
+    return [
+        task_id for task_id in task_id_list
+        if str(task_id) not in transaction_dict
+    ]
+
 
+def to_subs_transaction(data_dict):
+    """
+    Return a transaction.search subscriber edit in the shape of
+    maniphest.gettasktransactions, None for other transactions
+    """
+    if data_dict.get('type') != 'subscribers':
+        return None
+    operation_list = data_dict.get('fields', {}).get('operations', [])
+    # removed users stand in for the old value, so a user counts
+    # as subscribed by an edit that adds them
+    return {
+        'transactionID': str(data_dict['id']),
+        'transactionType': 'core:subscribers',
+        'oldValue': [
+            operation['phid'] for operation in operation_list
+            if operation['operation'] == 'remove'
+        ],
+        'newValue': [
+            operation['phid'] for operation in operation_list
+            if operation['operation'] == 'add'
+        ],
+        'authorPHID': data_dict.get('authorPHID'),
+        'dateCreated': str(data_dict['dateCreated']),
+    }
 
-def get_user_phid(username):
-    """ Return user's PhID"""
-    method_name = 'user.mediawikiquery'
+
+async def search_task_transactions(session, controller, task_id,
+                                   refresh=False):
+    """
+    Return task id and its subscriber transactions paged from
+    transaction.search, None if a page could not be fetched
+    """
+    method_name = 'transaction.search'
     query_params = {
-        'names[0]': username,
+        'objectIdentifier': 'T{}'.format(task_id),
+        'limit': TRANSACTION_PAGE_SIZE,
     }
-    json_data = fetch_data(method_name, query_params)
-    result_dict = json_data['result']
-    try:
-        user_phid = result_dict[0]['phid']
-    except TypeError:
-        error_code = json_data['error_code']
-        error_message = json_data['error_info']
-        logger(error_code, error_message)
-        sys.exit()
+    if author_phid is not None:
+        query_params['constraints[authorPHIDs][0]'] = author_phid
+    transaction_list = []
+    while True:
+        json_data = await fetch_method(
+            session, controller, method_name, query_params, refresh=refresh)
+        if json_data is None:
+            return task_id, None
+        result_dict = json_data['result']
+        for data_dict in result_dict['data']:
+            transaction = to_subs_transaction(data_dict)
+            if transaction is not None:
+                transaction_list.append(transaction)
+        next_page = result_dict['cursor']['after']
+        if not next_page:
+            break
+        query_params = dict(query_params, after=next_page)
 
-    return user_phid
+    return task_id, transaction_list
 
 
-def get_clean_date(date_string):
-    """ Return cleaned date"""
-    try:
-        date_object = datetime.datetime.strptime(date_string, '%Y-%m')
-    except ValueError as e:
-        error_message = 'please enter date in yyyy-mm format'
-        logger(e, error_message)
-        sys.exit()
+async def search_transactions(session, controller, task_id_list,
+                              refresh=False):
+    """
+    Return dictionary mapping task id to its subscriber
+    transactions, tasks whose pages failed are left out
+    """
+    transaction_dict = {}
+    pending = [
+        search_task_transactions(session, controller, task_id, refresh)
+        for task_id in task_id_list
+    ]
+    for future in asyncio.as_completed(pending):
+        task_id, transaction_list = await future
+        if transaction_list is not None:
+            transaction_dict[str(task_id)] = transaction_list
 
-    return date_object
+    return transaction_dict
 
 
-def get_user_subs_task(username):
+async def search_all(task_id_list, refresh, concurrency, timeout):
     """
-    Return list of task id's
-    on user is subscribed to
+    Return subscriber transactions of given tasks over a new
+    session, failed tasks are searched once more
     """
-    method_name = 'maniphest.search'
-    query_params = {
-        'constraints[subscribers][0]': username,
-    }
-    json_data = fetch_data(method_name, query_params)
-    result_dict = json_data['result']
-    data_list = result_dict['data']
-    task_id_list = []
-    for data_dict in data_list:
-        if data_dict['type'] == 'TASK':
-            task_id = data_dict['id']
-            task_id_list.append(task_id)
-
-    # Handling pagination in API
-    while result_dict['cursor']['after']:
-        next_page = result_dict['cursor']['after']
-        query_params = {
-            'constraints[subscribers][0]': username,
-            'after': next_page,
-        }
-        json_data = fetch_data(method_name, query_params)
-        result_dict = json_data['result']
-        data_list = result_dict['data']
-        for data_dict in data_list:
-            if data_dict['type'] == 'TASK':
-                task_id = data_dict['id']
-                task_id_list.append(task_id)
+    controller = AIMDController(concurrency, max_limit=MAX_CONCURRENCY)
+    async with open_async_session(timeout) as session:
+        transaction_dict = await search_transactions(
+            session, controller, task_id_list, refresh)
+        failed_id_list = get_missing_tasks(transaction_dict, task_id_list)
+        if failed_id_list:
+            transaction_dict.update(await search_transactions(
+                session, controller, failed_id_list, refresh))
 
-    return task_id_list
+    return transaction_dict
 
 
-def get_url(task_id_list):
+def fetch_transactions(task_id_list):
     """
-    Return json response for
-    given method name and parameters
+    Return transactions of given tasks, tasks whose batch
+    failed are fetched once more in batches of their own
     """
-    method_name = 'maniphest.gettasktransactions'
-    url_list = []
-    for task_id in task_id_list:
-        query_params = {
-            'ids[0]': task_id
-        }
-        url = BASE_URL + method_name
-        url += '?api.token='+API_KEY
-        url += '&ids[0]=' + str(task_id)
-        url_list.append(url)
+    transaction_dict = get_json_response(get_url(task_id_list))
+    failed_id_list = get_missing_tasks(transaction_dict, task_id_list)
+    if failed_id_list:
+        transaction_dict.update(
+            get_json_response(get_url(failed_id_list, REDRIVE_BATCH_SIZE)))
 
-    return url_list
+    return transaction_dict
 
 
-def get_json_response(url_list):
-    """ Return json response for given urls"""
-    resp = (grequests.get(url) for url in url_list)
-    reponse_list = grequests.map(resp, exception_handler=g_exception_handler)
-    return reponse_list
+def get_transactions(task_id_list, refresh=False):
+    """
+    Return dictionary mapping task id to its list of
+    transactions, only tasks missing from cache are fetched
+    unless refresh is set
+    """
+    if backend == 'search':
+        # transaction.search pages are cached on their own
+        return asyncio.run(search_all(
+            task_id_list, refresh, CONCURRENCY, REQUEST_TIMEOUT))
+    if client.cache is None:
+        return fetch_transactions(task_id_list)
+    if refresh:
+        transaction_dict, missing_id_list = {}, task_id_list
+    else:
+        transaction_dict, missing_id_list = client.cache.get_transactions(
+            task_id_list)
+        metrics.record_cache_hit(
+            'maniphest.gettasktransactions', len(transaction_dict))
+    fetched_dict = fetch_transactions(missing_id_list)
+    client.cache.set_transactions(fetched_dict)
+    transaction_dict.update(fetched_dict)
+    return transaction_dict
+
+
+def get_subs_date(transaction_dict, task_id_list, subscriber_phid=None):
+    """
+    Return a list of dates when user, or
+    subscriber_phid if given, is subscribed to a task
+    """
+    if subscriber_phid is None:
+        subscriber_phid = user_phid
+    return collect_subs_dates(transaction_dict, task_id_list, subscriber_phid)
 
 
-def get_subs_date(json_response_list, task_id_list):
+def get_subs_event(transaction_dict, task_id_list, min_transaction_id=0):
     """
-    Return a list of dates when
-    user is subscribed to a task
+    Return list of (task id, subscription date) events newer
+    than min_transaction_id and the largest transaction id seen
     """
-    list_length = len(task_id_list)
-    subs_date_list = []
-    for res_index in range(list_length):
-        try:
-            json_data = json_response_list[res_index].json()
-        except json.decoder.JSONDecodeError as e:
-            error_message = "unable to decode json"
-            logger(e, error_message)
-            sys.exit()
-        result_dict = json_data['result']
-        transaction_list = result_dict[str(task_id_list[res_index])]
+    subs_event_list = []
+    last_transaction_id = min_transaction_id
+    for task_id in task_id_list:
+        transaction_list = transaction_dict.get(str(task_id), [])
         for transaction in transaction_list:
-            if transaction['transactionType'] == 'core:subscribers':
-                cond_1 = user_phid not in transaction['oldValue']
-                cond_2 = user_phid in transaction['newValue']
-                if cond_1 and cond_2:
-                    subs_date = transaction['dateCreated']
-                    subs_date_list.append(subs_date)
-                    break
+            transaction_id = int(transaction['transactionID'])
+            last_transaction_id = max(last_transaction_id, transaction_id)
+        subs_date = find_subs_date(
+            transaction_list, user_phid, min_transaction_id)
+        if subs_date is not None:
+            subs_event_list.append((task_id, subs_date))
 
-    return subs_date_list
+    return subs_event_list, last_transaction_id
 
 
-def get_subs_per_week(input_date, subs_date_list):
+def sync_user_subs(username):
+    """
+    Merge user's subscription events since the last sync into
+    store and return all subscription dates and task id's that
+    could not be fetched
+    """
+    sync_time = int(time.time())
+    last_sync, min_transaction_id = store.get_watermark(username)
+    with metrics.phase('paginate'):
+        task_id_list = get_user_subs_task(username, modified_start=last_sync)
+    # modified tasks may have stale transactions in cache
+    with metrics.phase('fetch'):
+        transaction_dict = get_transactions(task_id_list, refresh=True)
+    with metrics.phase('aggregate'):
+        subs_event_list, last_transaction_id = get_subs_event(
+            transaction_dict, task_id_list, min_transaction_id)
+    missing_id_list = get_missing_tasks(transaction_dict, task_id_list)
+    if missing_id_list:
+        # keep the old watermark so unfetched tasks are synced next time
+        sync_time, last_transaction_id = last_sync, min_transaction_id
+    store.add_subs_events(username, user_phid, subs_event_list,
+                          sync_time, last_transaction_id)
+    return store.get_subs_dates(user_phid), missing_id_list
+
+
+async def page_subs_task(session, controller, username, task_queue,
+                         worker_count, modified_start=None, created_end=None):
     """
-    Return dictionary containing
-    subscription count of user per week
+    Put batches of task id's user is subscribed to
+    on task_queue as each search page arrives,
+    raise FetchError if a page can't be fetched
     """
-    input_date_month = input_date.month
-    input_date_year = input_date.year
-    subs_count_dict = {
-        '1': 0, '2': 0, '3': 0, '4': 0, '5': 0,
+    method_name = 'maniphest.search'
+    query_params = get_search_params(username, modified_start)
+    stop_workers = True
+    try:
+        while True:
+            json_data = await fetch_method(
+                session, controller, method_name, query_params)
+            if json_data is None:
+                raise FetchError('unable to fetch subscribed tasks')
+            result_dict = json_data['result']
+            task_id_list = get_page_task_ids(result_dict, created_end)
+            for task_id_chunk in chunk_list(task_id_list, BATCH_SIZE):
+                await task_queue.put(task_id_chunk)
+            if is_last_page(result_dict):
+                break
+            query_params['after'] = result_dict['cursor']['after']
+    except asyncio.CancelledError:
+        # cancelled along with the workers, none is left to stop
+        stop_workers = False
+        raise
+    finally:
+        # workers stop on their own even if paging failed
+        if stop_workers:
+            for _ in range(worker_count):
+                await task_queue.put(None)
+
+
+async def fetch_chunk_transactions(session, controller, task_id_chunk,
+                                   batch_size=BATCH_SIZE):
+    """ Return transactions of a batch of tasks, using cache if set"""
+    if backend == 'search':
+        return await search_transactions(session, controller, task_id_chunk)
+    if client.cache is None:
+        transaction_dict, missing_id_list = {}, task_id_chunk
+    else:
+        transaction_dict, missing_id_list = client.cache.get_transactions(
+            task_id_chunk)
+        metrics.record_cache_hit(
+            'maniphest.gettasktransactions', len(transaction_dict))
+    if missing_id_list:
+        fetched_dict = await fetch_transaction_urls(
+            session, controller, get_url(missing_id_list, batch_size))
+        if client.cache is not None:
+            client.cache.set_transactions(fetched_dict)
+        transaction_dict.update(fetched_dict)
+
+    return transaction_dict
+
+
+async def scan_chunk_subs(session, controller, task_id_chunk,
+                          subscriber_phid, batch_size=BATCH_SIZE):
+    """
+    Return subscription dates and unfetched task id's of a batch
+    of tasks, handing raw responses to scan_pool to decode and scan
+    """
+    keep_text = client.cache is not None
+    if keep_text:
+        cached_body_list, missing_id_list = (
+            client.cache.get_transaction_texts(task_id_chunk))
+        metrics.record_cache_hit(
+            'maniphest.gettasktransactions', len(cached_body_list))
+    else:
+        cached_body_list, missing_id_list = [], task_id_chunk
+    fetched_body_list = []
+    if missing_id_list:
+        fetched_list = await asyncio.gather(*[
+            fetch_bytes(session, controller, url)
+            for url in get_url(missing_id_list, batch_size)
+        ])
+        fetched_body_list = [
+            body for body in fetched_list if body is not None]
+    # only fetched bodies come back as text, cached ones keep their expiry
+    subs_event_list, fetched_id_list, text_dict = (
+        await asyncio.get_running_loop().run_in_executor(
+            scan_pool, scan_responses, cached_body_list, fetched_body_list,
+            subscriber_phid, keep_text))
+    if text_dict:
+        client.cache.set_transaction_texts(text_dict)
+    fetched_id_set = set(fetched_id_list)
+    failed_id_list = [
+        task_id for task_id in task_id_chunk
+        if str(task_id) not in fetched_id_set
+    ]
+    return [subs_date for _, subs_date in subs_event_list], failed_id_list
+
+
+async def get_chunk_subs(session, controller, task_id_chunk,
+                         subscriber_phid=None, batch_size=BATCH_SIZE):
+    """ Return subscription dates and unfetched task id's of a batch"""
+    if subscriber_phid is None:
+        subscriber_phid = user_phid
+    if scan_pool is not None and backend == 'transactions':
+        return await scan_chunk_subs(
+            session, controller, task_id_chunk, subscriber_phid, batch_size)
+    transaction_dict = await fetch_chunk_transactions(
+        session, controller, task_id_chunk, batch_size)
+    subs_date_list = get_subs_date(
+        transaction_dict, task_id_chunk, subscriber_phid)
+    return subs_date_list, get_missing_tasks(transaction_dict, task_id_chunk)
+
+
+async def fetch_subs_worker(session, controller, task_queue, event_queue,
+                            subscriber_phid=None):
+    """
+    Fetch and scan batches of tasks from task_queue, putting
+    subscription dates and unfetched task id's on event_queue
+    """
+    try:
+        while True:
+            task_id_chunk = await task_queue.get()
+            if task_id_chunk is None:
+                break
+            await event_queue.put(await get_chunk_subs(
+                session, controller, task_id_chunk, subscriber_phid))
+    finally:
+        # counted out by the collector even if fetching or scanning raised
+        event_queue.put_nowait(None)
+
+
+async def collect_subs_events(event_queue, worker_count):
+    """
+    Return subscription dates and unfetched task id's
+    put on event_queue until every worker is done
+    """
+    subs_date_list = []
+    failed_id_list = []
+    running_count = worker_count
+    while running_count:
+        event = await event_queue.get()
+        if event is None:
+            running_count -= 1
+            continue
+        subs_date_list.extend(event[0])
+        failed_id_list.extend(event[1])
+    return subs_date_list, failed_id_list
+
+
+async def subs_pipeline(session, controller, username, subscriber_phid=None,
+                        modified_start=None, created_end=None):
+    """
+    Return subscription dates of user and task id's that could not
+    be fetched over an open session, fetching transactions while
+    search still pages
+    """
+    task_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    event_queue = asyncio.Queue()
+    worker_count = MAX_CONCURRENCY
+    pager = asyncio.ensure_future(page_subs_task(
+        session, controller, username, task_queue, worker_count,
+        modified_start, created_end))
+    worker_list = [
+        asyncio.ensure_future(fetch_subs_worker(
+            session, controller, task_queue, event_queue, subscriber_phid))
+        for _ in range(worker_count)
+    ]
+    collector = asyncio.ensure_future(
+        collect_subs_events(event_queue, worker_count))
+    # stop everything on the first error instead of waiting on a
+    # pager blocked by a full queue or a worker that never finishes
+    done, pending = await asyncio.wait(
+        [pager, *worker_list], return_when=asyncio.FIRST_EXCEPTION)
+    for future in pending:
+        future.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for future in done:
+        if future.exception() is not None:
+            collector.cancel()
+            raise future.exception()
+    subs_date_list, failed_id_list = await collector
+
+    # failed batches are fetched once more in batches of their own
+    if failed_id_list:
+        redrive_date_list, failed_id_list = await get_chunk_subs(
+            session, controller, failed_id_list, subscriber_phid,
+            REDRIVE_BATCH_SIZE)
+        subs_date_list.extend(redrive_date_list)
+
+    return subs_date_list, failed_id_list
+
+
+async def run_subs_pipeline(username, concurrency, timeout,
+                            modified_start=None, created_end=None):
+    """
+    Return subscription dates of user and task id's
+    that could not be fetched over a new session
+    """
+    controller = AIMDController(concurrency, max_limit=MAX_CONCURRENCY)
+    async with open_async_session(timeout) as session:
+        return await subs_pipeline(
+            session, controller, username, user_phid, modified_start,
+            created_end)
+
+
+def get_subs_pipeline(username, modified_start=None, created_end=None,
+                      concurrency=CONCURRENCY, timeout=REQUEST_TIMEOUT):
+    """
+    Return subscription dates of user and task id's that could
+    not be fetched, paging and fetching at the same time
+    """
+    try:
+        return asyncio.run(run_subs_pipeline(
+            username, concurrency, timeout, modified_start, created_end))
+    except FetchError as e:
+        logger(e, str(e))
+        sys.exit()
+
+
+def get_team_subs_task(username_list, modified_start=None, created_end=None):
+    """
+    Return dictionary mapping each task id to
+    the users in username_list subscribed to it
+    """
+    task_user_dict = {}
+    for username in username_list:
+        for task_id in get_user_subs_task(
+                username, modified_start, created_end):
+            task_user_dict.setdefault(task_id, []).append(username)
+
+    return task_user_dict
+
+
+def get_team_subs_date(transaction_dict, task_user_dict, phid_dict):
+    """
+    Return dictionary mapping username to dates the user was
+    subscribed to a task, scanning each task's transactions once
+    """
+    subs_date_dict = {username: [] for username in phid_dict}
+    for task_id, username_list in task_user_dict.items():
+        pending_dict = {
+            phid_dict[username]: username for username in username_list
+            if username in phid_dict
+        }
+        for transaction in transaction_dict.get(str(task_id), []):
+            if not pending_dict:
+                break
+            if transaction['transactionType'] != 'core:subscribers':
+                continue
+            old_value = transaction['oldValue']
+            for phid in transaction['newValue']:
+                if phid in pending_dict and phid not in old_value:
+                    username = pending_dict.pop(phid)
+                    subs_date_dict[username].append(
+                        transaction['dateCreated'])
+
+    return subs_date_dict
+
+
+def get_subs_per_period(subs_date_dict, start_date, end_date, granularity):
+    """
+    Return dictionary mapping each user to subscription count
+    per period label between start and end date, for all users
+    in one pass
+    """
+    bin_start_days, count_dict = bin_user_epochs(
+        subs_date_dict, start_date, end_date, granularity)
+    label_list = get_bin_labels(bin_start_days, granularity)
+    return {
+        username: dict(zip(label_list, counts.tolist()))
+        for username, counts in count_dict.items()
     }
-    for date in subs_date_list:
-        date_object = datetime.datetime.fromtimestamp(int(date))
-        day = date_object.day
-        month = date_object.month
-        year = date_object.year
-        if month == input_date_month and year == input_date_year:
-            week_number = ceil(day/7)
-            subs_count_dict[str(week_number)] += 1
-
-    return subs_count_dict
-
-
-def print_subs_history(subs_count_dict):
-    """ Print users subscribed task per week"""
-    print('+------+---------------+')
-    print('| Week |  Subscription |')
-    print('+------+---------------+')
-    bar = '|'
-    for week, subs in subs_count_dict.items():
-        week_align = week.center(6, ' ')
-        subs_align = str(subs).center(15, ' ')
-        print(bar, week_align, bar, subs_align, bar, sep='')
-    print('+------+---------------+')
+
+
+def get_indexed_subs(index, username, start_date, end_date,
+                     granularity=None):
+    """
+    Return user's subscription count per week of the month of
+    start_date, or per granularity period from start to end date,
+    from the activity index, None if it doesn't cover the range
+    """
+    if granularity is None:
+        return index.get_month_weeks(SUBSCRIPTIONS, username, start_date)
+    return index.get_period_counts(
+        SUBSCRIPTIONS, username, start_date, end_date, granularity)
+
+
+def index_subs(index, subs_date_dict, start_date, end_date):
+    """
+    Record subscription dates of each user in the activity
+    index as all their subscriptions from start to end date
+    """
+    for username, subs_date_list in subs_date_dict.items():
+        index.set_epochs(SUBSCRIPTIONS, username, subs_date_list,
+                         start_date, end_date)
+    index.save()
+
+
+def print_missing_tasks(missing_id_list):
+    """ Print tasks left out of the report after all retries"""
+    task_names = ', '.join('T{}'.format(task_id) for task_id in missing_id_list)
+    print('Warning : could not fetch transactions of {} tasks: {}'.format(
+        len(missing_id_list), task_names))
 
 
 if __name__ == '__main__':
-    username = input('enter username > ')
-    date_string = input('enter date in yyyy-mm format > ')
-    user_phid = get_user_phid(username)
-    input_date = get_clean_date(date_string)
-    task_id_list = get_user_subs_task(username)
-    url_list = get_url(task_id_list)
-    json_response_list = get_json_response(url_list)
-    subs_date_list = get_subs_date(json_response_list, task_id_list)
-    subs_count_dict = get_subs_per_week(input_date, subs_date_list)
-    print_subs_history(subs_count_dict)
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description='Weekly task subscriptions of a Phabricator user')
+    parser.add_argument('username', nargs='?')
+    parser.add_argument('date', nargs='?', help='month in yyyy-mm format')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        '--incremental', action='store_true',
+        help='only fetch tasks modified since the last sync of this user')
+    mode_group.add_argument(
+        '--team', metavar='FILE',
+        help='report on every username listed in FILE, one per line')
+    parser.add_argument('--start', metavar='YYYY-MM-DD',
+                        help='report on a date range instead of a month')
+    parser.add_argument('--end', metavar='YYYY-MM-DD',
+                        help='last day of the date range, default today')
+    parser.add_argument('--granularity', choices=GRANULARITIES,
+                        default='week', help='period of the date range')
+    parser.add_argument('--backend', choices=BACKENDS, default=backend,
+                        help='fetch full task histories, or only subscriber '
+                        'edits with transaction.search')
+    parser.add_argument('--self-only', action='store_true',
+                        help='with --backend search, only count tasks the '
+                        'user subscribed to themselves')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='decode and scan transactions in this many '
+                        'processes, for users with many long-lived tasks')
+    parser.add_argument('--from-index', action='store_true',
+                        help='answer from the local activity index only, '
+                        'without network access')
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help='write request and phase metrics as json')
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help='write metrics in Prometheus text format')
+    args = parser.parse_args()
+    if args.self_only and (args.backend != 'search' or args.team):
+        parser.error('--self-only needs --backend search and a single user')
+    if args.from_index and (args.incremental or args.self_only):
+        parser.error('--from-index answers without fetching, it takes no '
+                     '--incremental or --self-only')
+    if args.workers and (args.team or args.incremental or args.from_index
+                         or args.backend == 'search'):
+        parser.error('--workers scans the transactions backend of a single '
+                     'user, it takes no --team, --incremental, --from-index '
+                     'or --backend search')
+    backend = args.backend
+    client.cache = ResponseCache()
+    if args.workers:
+        scan_pool = ProcessPoolExecutor(args.workers)
+    if args.team:
+        with open(args.team) as team_file:
+            username_list = [line.strip() for line in team_file
+                             if line.strip()]
+    else:
+        username_list = [args.username or input('enter username > ')]
+    if args.start:
+        start_date = get_clean_day(args.start)
+        if args.end:
+            end_date = get_clean_day(args.end)
+        else:
+            end_date = datetime.datetime.now()
+    else:
+        # with --team the only positional argument is the date
+        date_string = args.date or (args.team and args.username) or input(
+            'enter date in yyyy-mm format > ')
+        input_date = get_clean_date(date_string)
+        start_date = input_date
+        next_month = (input_date.replace(day=28)
+                      + datetime.timedelta(4)).replace(day=1)
+        end_date = next_month - datetime.timedelta(1)
+    index = ActivityIndex()
+    period_name = args.granularity.title() if args.start else 'Week'
+    if args.from_index:
+        subs_count_dict_dict = {}
+        for username in username_list:
+            subs_count_dict = get_indexed_subs(
+                index, username, start_date, end_date,
+                args.granularity if args.start else None)
+            if subs_count_dict is None:
+                error_message = ('no complete subscription index of {} for '
+                                 'this range, run without --from-index first'
+                                 ).format(username)
+                logger(None, error_message)
+                sys.exit()
+            subs_count_dict_dict[username] = subs_count_dict
+        missing_id_list = []
+    else:
+        # only tasks modified since the window started can hold
+        # its subscriptions
+        window_start, window_end = get_window(start_date, end_date)
+
+        if args.team:
+            with metrics.phase('resolve'):
+                phid_dict = get_user_phids(username_list)
+            with metrics.phase('paginate'):
+                task_user_dict = get_team_subs_task(
+                    list(phid_dict), window_start, window_end)
+            with metrics.phase('fetch'):
+                transaction_dict = get_transactions(list(task_user_dict))
+            missing_id_list = get_missing_tasks(
+                transaction_dict, list(task_user_dict))
+            with metrics.phase('aggregate'):
+                subs_date_dict = get_team_subs_date(
+                    transaction_dict, task_user_dict, phid_dict)
+        else:
+            username = username_list[0]
+            with metrics.phase('resolve'):
+                user_phid = get_user_phid(username)
+            if args.self_only:
+                author_phid = user_phid
+            if args.incremental:
+                store = SubscriptionStore()
+                subs_date_list, missing_id_list = sync_user_subs(username)
+            else:
+                # paging, fetching and scanning overlap in one phase
+                with metrics.phase('fetch'):
+                    subs_date_list, missing_id_list = get_subs_pipeline(
+                        username, window_start, window_end)
+            subs_date_dict = {username: subs_date_list}
+
+        with metrics.phase('aggregate'):
+            if args.start:
+                subs_count_dict_dict = get_subs_per_period(
+                    subs_date_dict, start_date, end_date, args.granularity)
+            else:
+                subs_count_dict_dict = {
+                    username: get_month_week_counts(subs_date_list,
+                                                    input_date)
+                    for username, subs_date_list in subs_date_dict.items()
+                }
+        # only complete results can stand for every subscription of a day
+        if not missing_id_list and author_phid is None:
+            index_subs(index, subs_date_dict, start_date, end_date)
+    for username, subs_count_dict in subs_count_dict_dict.items():
+        if args.team:
+            print(username)
+        print_period_counts(subs_count_dict, period_name)
+    if missing_id_list:
+        print_missing_tasks(missing_id_list)
+    if scan_pool is not None:
+        scan_pool.shutdown()
+    metrics.write(args.metrics_json, args.metrics_prom)